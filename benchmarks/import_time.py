@@ -0,0 +1,80 @@
+"""Cold-start import benchmark for the lab-data function.
+
+Each scenario runs in a fresh interpreter, so module caches are cold the
+way they are on a new consumption-plan worker:
+
+    python benchmarks/import_time.py [--repeat 5] [--budget-ms 300]
+
+The script exits non-zero if the OPTIONS/GET path loads any of the heavy
+modules, or if its median time goes over the budget.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that only the upload path should need
+HEAVY_MODULES = ("pdfplumber", "pdfminer", "sqlalchemy", "pymssql", "requests_toolbelt")
+
+SCENARIO = r"""
+import sys, json, time, importlib.util
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import azure.functions as func
+spec = importlib.util.spec_from_file_location("lab_data", {root!r} + "/lab-data/__init__.py")
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+{body}
+done = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "total_ms": (done - start) * 1000,
+    "heavy": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+SCENARIOS = {
+    "options": 'module.main(func.HttpRequest("OPTIONS", "http://localhost/api/lab-data", body=b""))',
+    "get": 'module.main(func.HttpRequest("GET", "http://localhost/api/lab-data", body=b""))',
+    "upload_imports": "import shared_code.pipeline",
+}
+
+
+def run(name):
+    code = SCENARIO.format(root=ROOT, body=SCENARIOS[name], heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="median budget for the OPTIONS/GET paths")
+    args = parser.parse_args()
+
+    failed = False
+    for name in SCENARIOS:
+        runs = [run(name) for _ in range(args.repeat)]
+        import_ms = statistics.median(r["import_ms"] for r in runs)
+        total_ms = statistics.median(r["total_ms"] for r in runs)
+        heavy = runs[-1]["heavy"]
+        print(f"{name:15} import {import_ms:7.1f} ms   total {total_ms:7.1f} ms   heavy modules: {', '.join(heavy) or '-'}")
+
+        if name != "upload_imports":
+            if heavy:
+                print(f"  FAIL: {name} loaded {', '.join(heavy)}")
+                failed = True
+            if total_ms > args.budget_ms:
+                print(f"  FAIL: {name} took {total_ms:.1f} ms, budget is {args.budget_ms:.0f} ms")
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""End-to-end benchmark and extraction regression check for lab-data.
+
+Every synthetic case is posted through the function's main() against a
+SQLite stand-in for the Jackson database:
+
+    python benchmarks/pipeline_bench.py [--cases small] [--repeat 3] [--load-mode merge]
+
+For each case it reports:
+
+- the median per-stage latencies from the Server-Timing header
+- pages/sec and rows/sec
+- the highest RSS sampled during the request
+
+Each case's combined_rows is also parsed directly and reduced to each
+sample's {field: float or None}, sorted by sample. That form doesn't
+depend on how the pipeline holds its rows, and it must hash to the digest
+recorded in combined_rows.json, which catches any optimization that
+changes what gets extracted. After an intended extraction change, rerun
+with --update-golden.
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import statistics
+import tempfile
+import importlib.util
+from collections import Counter
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import azure.functions as func  # noqa: E402
+from benchmarks.synthetic_reports import CASES, make_report  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "combined_rows.json")
+BOUNDARY = "labdatabenchmark"
+SERVER_TIMING_ENTRY = re.compile(r"([\w-]+);dur=([\d.]+)")
+
+sqlite3.register_adapter(Decimal, str)
+
+
+def create_standin_db(directory):
+    """Create SQLite databases matching the Jackson tables and point the
+    shared engine at them."""
+    from shared_code import db
+    from shared_code.analytes import FIELD_MAP, QUERY_TYPE_TO_TABLE
+    from sqlalchemy import event
+
+    main_path = os.path.join(directory, "lab-data.db")
+    jackson_path = os.path.join(directory, "jackson.db")
+    con = sqlite3.connect(main_path)
+    con.execute(f"ATTACH DATABASE '{jackson_path}' AS Jackson")
+    for query_type, fields in FIELD_MAP.items():
+        columns = ", ".join(f"[{field}] {'TEXT' if i < 3 else 'NUMERIC'}" for i, field in enumerate(fields))
+        con.execute(f"CREATE TABLE {QUERY_TYPE_TO_TABLE[query_type]} ({columns})")
+    con.commit()
+    con.close()
+
+    os.environ["SQL_CONNECTION_URL"] = f"sqlite:///{main_path}"
+    db._engine = None
+    event.listen(db.get_engine(), "connect", lambda dbapi_con, _: dbapi_con.execute(f"ATTACH DATABASE '{jackson_path}' AS Jackson"))
+
+
+def load_function():
+    spec = importlib.util.spec_from_file_location("lab_data", os.path.join(ROOT, "lab-data", "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def upload_request(pdf, query_type, file_name, load_mode):
+    body = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"query_type\"\r\n\r\n{query_type}\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"load_mode\"\r\n\r\n{load_mode}\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{file_name}\"\r\n"
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + pdf + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return func.HttpRequest(
+        "POST", "http://localhost/api/lab-data",
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+        body=body,
+    )
+
+
+def combined_rows_digest(pdf, case):
+    """Hash parse_pdf's combined_rows as each sample's analyte results,
+    sorted by (sample location, sampling date/time)."""
+    from shared_code.analytes import FIELD_MAP
+    from shared_code.pipeline import parse_pdf
+
+    fields = FIELD_MAP[case.query_type][3:]
+    rows = parse_pdf(pdf, case.query_type, f"{case.name}.pdf", Counter())
+    samples = [
+        ([sample_location, sample_datetime], dict(zip(fields, values)))
+        for _, sample_location, sample_datetime, *values in rows.param_rows()
+    ]
+    samples.sort(key=lambda sample: (sample[0][0], sample[0][1] is not None, sample[0][1] or ""))
+    payload = json.dumps(samples, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return {"rows": len(samples), "sha256": hashlib.sha256(payload.encode()).hexdigest()}
+
+
+def run_case(function, case, pdf, repeat, load_mode):
+    stages, totals = {}, []
+    pages = rows = 0
+    max_rss = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = function.main(upload_request(pdf, case.query_type, f"{case.name}.pdf", load_mode))
+        totals.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f"{case.name}: HTTP {response.status_code} {response.get_body()[:200]!r}")
+
+        result = json.loads(response.get_body())
+        pages = result["page_stats"].get("pages", 0)
+        rows = result.get("inserted_rows", 0) + result.get("updated_rows", 0) + result.get("unchanged_rows", 0)
+        max_rss = max(max_rss, float(response.headers.get("X-RSS-Max-Sampled-MB", 0)))
+        for name, ms in SERVER_TIMING_ENTRY.findall(response.headers.get("Server-Timing", "")):
+            stages.setdefault(name, []).append(float(ms))
+
+    seconds = statistics.median(totals)
+    return {
+        "case": case.name,
+        "pages": pages,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 1),
+        "rows_per_sec": round(rows / seconds, 1),
+        "rss_max_sampled_mb": max_rss,
+        "stages_ms": {name: round(statistics.median(values), 1) for name, values in stages.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--load-mode", choices=("insert", "merge"), default="insert")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--update-golden", action="store_true", help="record the current combined_rows digests")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # Every repeat should parse the PDF, not hit the parse cache
+    os.environ.setdefault("PARSE_CACHE_SIZE", "0")
+    os.environ.pop("PARSE_CACHE_DIR", None)
+
+    cases = [case for case in CASES if args.cases in case.name]
+    with open(GOLDEN_PATH) as f:
+        golden = json.load(f)
+
+    results, mismatches = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        create_standin_db(directory)
+        function = load_function()
+        for case in cases:
+            pdf = make_report(case.query_type, case.pages, case.samples, case.seed)
+            digest = combined_rows_digest(pdf, case)
+            if args.update_golden:
+                golden[case.name] = digest
+            elif golden.get(case.name) != digest:
+                mismatches.append((case.name, golden.get(case.name), digest))
+
+            result = run_case(function, case, pdf, args.repeat, args.load_mode)
+            results.append(result)
+            stages = "  ".join(f"{name} {ms:.0f}" for name, ms in result["stages_ms"].items())
+            print(
+                f"{case.name:16} {result['pages']:3} pages {result['rows']:4} rows  {result['seconds']:7.3f} s  "
+                f"{result['pages_per_sec']:6.1f} pages/s  {result['rows_per_sec']:7.1f} rows/s  "
+                f"rss {result['rss_max_sampled_mb']:.0f} MB\n    {stages}"
+            )
+
+    if args.update_golden:
+        with open(GOLDEN_PATH, "w") as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Recorded combined_rows digests for {len(cases)} cases")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for name, expected, actual in mismatches:
+        print(f"FAIL: {name} combined_rows changed: expected {expected}, got {actual}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Synthetic ALS-style certificate of analysis PDFs.
+
+Reports are written with a small built-in PDF writer (Helvetica text and
+ruled table cells), so they can be generated offline with no extra
+dependencies. Each report has the following pages:
+
+- a cover page
+- one results table per page
+- a trailing QC table that holds no analytes
+
+Analyte labels come from the shared FIELD_MAP and CAS/abbreviation tables.
+They cover the label shapes the parser has to handle:
+
+- plain names
+- names that wrap onto a second line, within the cell or onto a
+  continuation row
+- CAS-only labels and abbreviations
+- method headings and unknown analytes
+
+Result cells mix plain numbers with values prefixed by ``<`` or ``~``,
+plus ``----`` and blanks.
+
+Everything is seeded, so a given case always produces the same bytes.
+"""
+import random
+from typing import NamedTuple
+
+from shared_code.analytes import ABBREV_TO_FULL, CAS_TO_FULL, FIELD_MAP
+
+FONT_SIZE = 6
+LINE_HEIGHT = 8
+ROW_PADDING = 6
+
+
+class Layout(NamedTuple):
+    page_size: tuple  # (width, height) in points
+    label_width: int
+    unit: str
+    method_headings: tuple
+    unknown_labels: tuple
+
+
+LAYOUTS = {
+    "ds-pfas": Layout(
+        (842, 595), 170, "µg/L",
+        ("EP231X: Per- and Polyfluoroalkyl Substances (PFAS)", "EP231S: PFAS Surrogate"),
+        ("Perfluoro-2-propoxypropanoic acid", "Moisture Content"),
+    ),
+    "ds-int": Layout(
+        (595, 842), 150, "mg/L",
+        ("EA010P: Conductivity by PC Titrator", "EK062G: Total Nitrogen as N (TKN + NOx) by Discrete Analyser"),
+        ("pH Value", "Total Dissolved Solids @180°C"),
+    ),
+    "ds-ext": Layout(
+        (842, 595), 160, "mg/kg",
+        ("EG020T: Total Metals by ICP-MS", "EP080: BTEXN", "EP075(SIM)A: Phenolic Compounds"),
+        ("Moisture Content", "Chromium (hexavalent)"),
+    ),
+}
+
+
+class Case(NamedTuple):
+    name: str
+    query_type: str
+    pages: int
+    samples: int
+    seed: int
+
+
+CASES = [
+    Case(f"{query_type}-{size}", query_type, pages, samples, seed)
+    for seed, query_type in enumerate(FIELD_MAP)
+    for size, pages, samples in (("small", 3, 4), ("medium", 12, 8), ("large", 40, 12))
+]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _table_ops(rows, x0, y0, col_widths):
+    """Drawing operators for a ruled table. A cell holding newlines is
+    written as several lines and its row grows to fit."""
+    ops = []
+    y = y0
+    for row in rows:
+        lines = max(cell.count("\n") + 1 for cell in row)
+        row_height = lines * LINE_HEIGHT + ROW_PADDING
+        x = x0
+        for width, cell in zip(col_widths, row):
+            ops.append(f"{x:.1f} {y - row_height:.1f} {width:.1f} {row_height:.1f} re S")
+            for n, line in enumerate(cell.split("\n") if cell else []):
+                baseline = y - ROW_PADDING / 2 - (n + 1) * LINE_HEIGHT + 2
+                ops.append(f"BT /F1 {FONT_SIZE} Tf {x + 1.5:.1f} {baseline:.1f} Td ({_escape(line)}) Tj ET")
+            x += width
+        y -= row_height
+    return ops
+
+
+def _text_ops(lines, x, y, size=10):
+    return [f"BT /F1 {size} Tf {x} {y - n * (size + 4)} Td ({_escape(line)}) Tj ET" for n, line in enumerate(lines)]
+
+
+def build_pdf(pages, page_size):
+    """Assemble a PDF from a list of per-page drawing operator lists."""
+    width, height = page_size
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages))).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, ops in enumerate(pages):
+        content = "\n".join(["0.5 w"] + ops).encode("cp1252", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _result(rnd):
+    r = rnd.random()
+    if r < 0.2:
+        return f"<{rnd.choice(('0.01', '0.002', '1', '5'))}"
+    if r < 0.28:
+        return f"~{rnd.random() * 10:.2f}"
+    if r < 0.36:
+        return "----"
+    if r < 0.4:
+        return ""
+    return f"{rnd.random() * 100:.{rnd.randint(0, 4)}f}"
+
+
+def _label_rows(query_type, rnd, layout):
+    """Label cells (one or two table rows each) for one results table."""
+    cas_by_field = {full: cas for cas, full in CAS_TO_FULL.items()}
+    abbrev_by_field = {full: abbrev.upper() for abbrev, full in ABBREV_TO_FULL.items()}
+    fields = FIELD_MAP[query_type][3:]
+
+    labels = [[rnd.choice(layout.method_headings)]]
+    for field in rnd.sample(fields, min(len(fields), rnd.randint(6, 22))):
+        shape = rnd.random()
+        words = field.split()
+        if shape < 0.15 and field in cas_by_field:
+            labels.append([cas_by_field[field]])
+        elif shape < 0.25 and field in abbrev_by_field:
+            labels.append([abbrev_by_field[field]])
+        elif shape < 0.45 and len(words) > 2:
+            cut = len(words) // 2
+            labels.append([" ".join(words[:cut]) + "\n" + " ".join(words[cut:])])
+        elif shape < 0.5 and len(words) > 2:
+            cut = len(words) // 2
+            labels.append([" ".join(words[:cut]), " ".join(words[cut:])])
+        else:
+            labels.append([field])
+    labels.insert(rnd.randint(1, len(labels)), [rnd.choice(layout.unknown_labels)])
+    return labels, cas_by_field
+
+
+def make_report(query_type, pages=4, samples=6, seed=0):
+    """PDF bytes for a report of ``pages`` results pages and ``samples``
+    sample columns per table."""
+    rnd = random.Random(f"{query_type}-{seed}")
+    layout = LAYOUTS[query_type]
+    width, height = layout.page_size
+    value_width = max(28, (width - 40 - layout.label_width - 80) // samples)
+    col_widths = [layout.label_width, 50, 30] + [value_width] * samples
+
+    page_ops = [_text_ops(["CERTIFICATE OF ANALYSIS", f"Work Order: EB{seed:05d}", "Client: Synthetic Sites Pty Ltd"], 40, height - 60)]
+    for page in range(pages):
+        locations = [f"MW{page:02d}-{s:02d}" if rnd.random() > 0.05 else "----" for s in range(samples)]
+        dates = [f"{1 + (page + s) % 28:02d}-Mar-2024 {8 + s % 9:02d}:{(7 * s) % 60:02d}" for s in range(samples)]
+        rows = [
+            ["Client sample ID", "", ""] + locations,
+            ["Client sampling date / time", "", ""] + dates,
+            ["Compound", "CAS Number", "Unit"] + ["Result"] * samples,
+        ]
+        labels, cas_by_field = _label_rows(query_type, rnd, layout)
+        for cells in labels:
+            label = cells[0]
+            cas = cas_by_field.get(label.replace("\n", " "), "")
+            rows.append([label, cas, layout.unit] + [_result(rnd) for _ in range(samples)])
+            for continuation in cells[1:]:
+                rows.append([continuation, "", ""] + [""] * samples)
+        page_ops.append(_text_ops([f"Page {page + 2} of {pages + 2}"], 40, height - 20, 8) + _table_ops(rows, 20, height - 30, col_widths))
+
+    qc_rows = [["Quality Control Report", "", "Lot"]] + [[f"QC sample {n}", "", f"QC{n:03d}"] for n in range(6)]
+    page_ops.append(_text_ops(["QUALITY CONTROL REPORT"], 40, height - 20) + _table_ops(qc_rows, 20, height - 40, [160, 50, 60]))
+    return build_pdf(page_ops, layout.page_size)
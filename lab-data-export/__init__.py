@@ -0,0 +1,61 @@
+import azure.functions as func
+import json
+import logging
+from urllib.parse import urlencode
+from shared_code import timing
+
+# Reads go through their own function so the host can require a function
+# key for them, while lab-data stays open to the static web app. SQLAlchemy
+# is only imported once the parameters have validated.
+
+
+def export_response(req):
+    """One keyset page of a Jackson lab table as NDJSON or CSV. The next
+    page's cursor is returned in X-Next-Cursor and a Link header."""
+    from shared_code import export
+
+    try:
+        query = export.parse_query(req.params, req.headers.get("Accept", ""))
+    except export.QueryError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=400, mimetype="application/json")
+
+    try:
+        with timing.stage("export"):
+            body, next_cursor, row_count = export.get_page(query)
+    except Exception as e:
+        logging.exception("❌ Database query failed.")
+        return func.HttpResponse(
+            json.dumps({"error": "Database query failed", "details": str(e)}),
+            status_code=500,
+            mimetype="application/json"
+        )
+
+    timing.count("rows_exported", row_count)
+    headers = {}
+    if query.format == "csv":
+        headers["Content-Disposition"] = f'attachment; filename="{query.query_type}.csv"'
+    if next_cursor:
+        # The function key is left out; callers send it again themselves
+        params = {name: value for name, value in req.params.items() if name != "code"}
+        next_url = f"{req.url.split('?')[0]}?{urlencode({**params, 'cursor': next_cursor})}"
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return func.HttpResponse(body, status_code=200, headers=headers, mimetype=export.FORMATS[query.format])
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    timer = timing.RequestTimer("lab-data-export")
+    try:
+        with timing.activate(timer):
+            response = export_response(req)
+    except Exception as e:
+        logging.exception("Unhandled exception")
+        response = func.HttpResponse(
+            json.dumps({"error": "Internal server error", "details": str(e)}),
+            status_code=500,
+            mimetype="application/json"
+        )
+
+    timing.emit(timer)
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
@@ -0,0 +1,9 @@
+import azure.functions as func
+import logging
+from shared_code.jobs import run_job
+
+
+def main(msg: func.QueueMessage) -> None:
+    job_id = msg.get_body().decode().strip()
+    logging.info(f"Running lab-data job {job_id} (dequeue count {msg.dequeue_count})")
+    run_job(job_id, dequeue_count=msg.dequeue_count)
@@ -0,0 +1,13 @@
+# Helpers shared by the function apps in this project.
+import os
+import logging
+
+
+def int_setting(name, default):
+    """Integer app setting ``name``, or ``default`` when it is unset or
+    malformed, so one bad setting can't fail every request."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        logging.warning(f"Ignoring non-integer app setting {name}")
+        return default
@@ -0,0 +1,288 @@
+import re
+import logging
+from bisect import bisect_right
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from shared_code.automaton import PatternAutomaton
+
+FIELD_MAP = {
+    "ds-pfas": [
+        "File Name",
+        "Sample Location",
+        "Sampling Date/Time",
+        "Perfluorobutane sulfonic acid", "Perfluoropentane sulfonic acid", "Perfluorohexane sulfonic acid",
+        "Perfluoroheptane sulfonic acid", "Perfluorooctane sulfonic acid", "Perfluorodecane sulfonic acid",
+        "Perfluorobutanoic acid", "Perfluoropentanoic acid", "Perfluorohexanoic acid", "Perfluoroheptanoic",
+        "Perfluorooctanoic acid", "Perfluorononanoic acid", "Perfluorodecanoic acid", "Perfluoroundecanoic acid",
+        "Perfluorododecanoic acid", "Perfluorotridecanoic acid", "Perfluorotetradecanoic acid",
+        "Perfluorooctane sulfonamide", "N-Methyl perfluorooctane sulfonamide",
+        "N-Ethyl perfluorooctane sulfonamide", "N-Methyl perfluorooctane sulfonamidoethanol",
+        "N-Ethyl perfluorooctane sulfonamidoethanol", "N-Methyl perfluorooctane sulfonamidoacetic acid",
+        "N-Ethyl perfluorooctane sulfonamidoacetic acid", "4:2 Fluorotelomer sulfonic acid",
+        "6:2 Fluorotelomer sulfonic acid", "8:2 Fluorotelomer sulfonic acid",
+        "10:2 Fluorotelomer sulfonic acid", "Sum of PFAS", "Sum of PFHxS and PFOS",
+        "Sum of TOP C4 - C14 Carboxylates and C4-C8 Sulfonates", "Sum of TOP C4 - C14 as Fluorine",
+        "13C4-PFOS", "13C8-PFOA"
+    ],
+    "ds-int": [
+        "File Name",
+        "Sample Location",
+        "Sampling Date/Time",
+        "Electrical Conductivity @ 25°C","Nitrite + Nitrate as N",
+        "Total Kjeldahl Nitrogen as N","Total Nitrogen as N","Total Phosphorus as P"
+    ],
+    "ds-ext": [
+        "File Name",
+        "Sample Location",
+        "Sampling Date/Time",
+        "Total Arsenic","Total Beryllium","Total Cadmium","Total Chromium",
+        "Total Copper","Total Cobalt","Total Nickel","Total Lead","Total Zinc","Total Manganese","Total Selenium","Total Silver","Total Vanadium",
+        "Total Boron","Total Mercury","Total Organic Carbon","TPH Silica C10 - C14 Fraction","TPH Silica C15 - C28 Fraction",
+        "TPH Silica C29 - C36 Fraction","TPH Silica C10 - C36 Fraction (sum)","TRH C10 - C16 Fraction","TRH C16 - C34 Fraction",
+        "TRH C34 - C40 Fraction","TRH C10 - C40 Fraction (sum)","TRH C10 - C16 Fraction minus Naphthalene","Phenol","2-Chlorophenol","2-Methylphenol",
+        "3- & 4-Methylphenol","2-Nitrophenol","2,4-Dimethylphenol","2,6-Dichlorophenol","4-Chloro-3-methylphenol","2,4,6-Trichlorophenol",
+        "2,4,5-Trichlorophenol","Pentachlorophenol","Sum of Phenols","TPH C6 - C9 Fraction","TRH NEPMC6 - C10 Fraction C6_C10",
+        "TRH NEPMC6 - C10 Fraction minus BTEX","Benzene","Toluene","Ethylbenzene","meta- & para-Xylene","ortho-Xylene","Total Xylenes",
+        "Sum of BTEX","Naphthalene","Escherichia coli","Phenol-d6","2-Chlorophenol-D4","2,4,6-Tribromophenol","2-Fluorobiphenyl",
+        "Anthracene-d10","4-Terphenyl-d14","1,2-Dichloroethane-D4","Toluene-D8","4-Bromofluorobenzene", "Sulfate", "Sulfur"
+    ]
+}
+
+ABBREV_TO_FULL = {
+    "mefosa": "N-Methyl perfluorooctane sulfonamide",
+    "etfosa": "N-Ethyl perfluorooctane sulfonamide",
+    "mefose": "N-Methyl perfluorooctane sulfonamidoethanol",
+    "etfose": "N-Ethyl perfluorooctane sulfonamidoethanol",
+    "mefosaa": "N-Methyl perfluorooctane sulfonamidoacetic acid",
+    "etfosaa": "N-Ethyl perfluorooctane sulfonamidoacetic acid"
+}
+
+CAS_TO_FULL = {
+    "14808-79-8": "Sulfate",
+    "63705-05-5": "Sulfur",
+    "2355-31-9": "N-Methyl perfluorooctane sulfonamidoacetic acid",  # MeFOSAA
+    "2991-50-6": "N-Ethyl perfluorooctane sulfonamidoacetic acid",   # EtFOSAA
+    "31506-32-8": "N-Methyl perfluorooctane sulfonamide",             # MeFOSA
+    "4151-50-2": "N-Ethyl perfluorooctane sulfonamide",              # EtFOSA
+    "24448-09-7": "N-Methyl perfluorooctane sulfonamidoethanol",     # MeFOSE
+    "1691-99-2": "N-Ethyl perfluorooctane sulfonamidoethanol",        # EtFOSE
+    "7440-38-2": "Total Arsenic",
+    "7440-41-7": "Total Beryllium",
+    "7440-43-9": "Total Cadmium",
+    "7440-47-3": "Total Chromium",
+    "7440-50-8": "Total Copper",
+    "7440-48-4": "Total Cobalt",
+    "7440-02-0": "Total Nickel",
+    "7439-92-1": "Total Lead",
+    "7440-66-6": "Total Zinc",
+    "7439-96-5": "Total Manganese",
+    "7782-49-2": "Total Selenium",
+    "7440-22-4": "Total Silver",
+    "7440-62-2": "Total Vanadium",
+    "7440-42-8": "Total Boron",
+    "7439-97-6": "Total Mercury",
+    "108-95-2": "Phenol",
+    "95-57-8": "2-Chlorophenol",
+    "95-48-7": "2-Methylphenol",
+    "1319-77-3": "3- & 4-Methylphenol",
+    "88-75-5": "2-Nitrophenol",
+    "105-67-9": "2,4-Dimethylphenol",
+    "120-83-2": "2,4-Dichlorophenol",
+    "87-65-0": "2,6-Dichlorophenol",
+    "59-50-7": "4-Chloro-3-methylphenol",
+    "88-06-2": "2,4,6-Trichlorophenol",
+    "95-95-4": "2,4,5-Trichlorophenol",
+    "87-86-5": "Pentachlorophenol",
+    "C6_C10": "TRH NEPMC6 - C10 Fraction C6_C10",
+    "71-43-2": "Benzene",
+    "108-88-3": "Toluene",
+    "100-41-4": "Ethylbenzene",
+    "108-38-3 106-42-3": "meta- & para-Xylene",
+    "95-47-6": "ortho-Xylene",
+    "91-20-3": "Naphthalene",
+    "13127-88-3": "Phenol-d6",
+    "93951-73-6": "2-Chlorophenol-D4",
+    "118-79-6": "2,4,6-Tribromophenol",
+    "321-60-8": "2-Fluorobiphenyl",
+    "1719-06-8": "Anthracene-d10",
+    "1718-51-0": "4-Terphenyl-d14",
+    "17060-07-0": "1,2-Dichloroethane-D4",
+    "2037-26-5": "Toluene-D8",
+    "460-00-4": "4-Bromofluorobenzene",
+}
+
+NON_ANALYTE_LABELS = [
+    "results", "result", "cas number", "parameter", "compound", "unit",
+    "sampling date", "sample id", "sub-matrix", "matrix",
+    "ep075", "ep080", "eg020t", "phenolic compounds", "btexn",
+    "surrogate", "notes", "qc", "page", "work order", "client", "project",
+    "EG020T: Total Metals by ICP-MS","EG035T: Total Recoverable Mercury by FIMS","EP005: Total Organic Carbon (TOC)",
+    "EP071 SG: Total Petroleum Hydrocarbons - Silica gel cleanup","EP071 SG: Total Recoverable Hydrocarbons - NEPM 2013 Fractions - Silica gel cleanup",
+    "EP071 SG: Total Recoverable Hydrocarbons - NEPM 2013 Fractions - Silica gel cleanup - Continued",
+    "EP075(SIM)A: Phenolic Compounds","EP080/071: Total Petroleum Hydrocarbons","EP080/071: Total Recoverable Hydrocarbons - NEPM 2013 Fractions",
+    "EP080: BTEXN","MW006: Thermotolerant Coliforms & E.coli by MF","EP075(SIM)S: Phenolic Compound Surrogates",
+    "EP075(SIM)T: PAH Surrogates","EP080S: TPH(V)/BTEX Surrogates"
+]
+
+
+QUERY_TYPE_TO_TABLE = {
+    "ds-pfas": "[Jackson].[DSPFAS]",
+    "ds-int": "[Jackson].[DSInt]",
+    "ds-ext": "[Jackson].[DSExt]"
+}
+
+def normalize(text):
+    if not text:
+        return ''
+    # Replace long dash sequences with space, remove punctuation, and collapse spaces
+    text = re.sub(r'[-–—]+', ' ', text)
+    text = re.sub(r'[^\w\s]', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.lower().strip()
+
+PARTIAL_MATCH_MAP = {
+      normalize("Sum of TOP C4 - C14 Carboxylates and C4"): "Sum of TOP C4 - C14 Carboxylates and C4-C8 Sulfonates",
+      normalize("^ C6 - C10 Fraction minus BTEX C6_C10-BTEX(F1)"): "TRH NEPMC6 - C10 Fraction minus BTEX",
+      normalize("C10 - C14 Fraction"): "TPH Silica C10 - C14 Fraction",
+      normalize("C15 - C28 Fraction"): "TPH Silica C15 - C28 Fraction",
+      normalize("C29 - C36 Fraction"): "TPH Silica C29 - C36 Fraction",
+      normalize("^ C10 - C36 Fraction (sum)"): "TPH Silica C10 - C36 Fraction (sum)",
+      normalize(">C10 - C16 Fraction"): "TRH C10 - C16 Fraction",
+      normalize(">C16 - C34 Fraction"): "TRH C16 - C34 Fraction",
+      normalize(">C34 - C40 Fraction"): "TRH C34 - C40 Fraction",
+      normalize("^ >C10 - C40 Fraction (sum)"): "TRH C10 - C40 Fraction (sum)",
+      normalize(">C10 - C16 Fraction minus Naphthalene (F2)"): "TRH C10 - C16 Fraction minus Naphthalene",
+      normalize("^ C6 - C10 Fraction minus BTEX C6_C10-BTEX (F1)"): "TRH NEPMC6 - C10 Fraction minus BTEX"
+}
+
+
+# Labels that repeat on every page of a report are resolved once per worker
+RESOLVE_CACHE_SIZE = 4096
+
+SKIP_LABELS = {"", "result", "results", "cas", "parameter"}
+
+CAS_PATTERN = re.compile(r'\b\d{2,7}-\d{2}-\d\b')
+ABBREV_PATTERN = re.compile(r'\b[a-z]{2,6}\b')
+
+NON_ANALYTE_AUTOMATON = PatternAutomaton(NON_ANALYTE_LABELS)
+
+
+class Resolution(NamedTuple):
+    normalized: str
+    match: Optional[str]
+    skipped: bool
+
+
+class AnalyteResolver:
+    """Maps raw row labels from a results table onto the FIELD_MAP columns
+    of one query_type.
+
+    The lookup order is the same as the original match chain: strict name,
+    CAS number, partial override, abbreviation, then substring fallback.
+    Every index is built once so a lookup never rescans the field list.
+    """
+
+    def __init__(self, query_type):
+        self.query_type = query_type
+        self.analyte_fields = FIELD_MAP[query_type][2:]
+        field_set = set(self.analyte_fields)
+        normalized_fields = [normalize(f) for f in self.analyte_fields]
+
+        self._strict_index = {}
+        for field, normalized in zip(self.analyte_fields, normalized_fields):
+            self._strict_index.setdefault(normalized, field)
+
+        self._cas_index = {cas: full for cas, full in CAS_TO_FULL.items() if full in field_set}
+        self._abbrev_index = {abbrev: full for abbrev, full in ABBREV_TO_FULL.items() if full in field_set}
+
+        # Forward substring check: which field names occur inside the label
+        self._field_automaton = PatternAutomaton(normalized_fields)
+
+        # Reverse substring check: is the label inside a field name. Searching
+        # one joined string finds the earliest field in FIELD_MAP order.
+        self._joined_fields = "\0".join(normalized_fields)
+        self._field_offsets = []
+        offset = 0
+        for normalized in normalized_fields:
+            self._field_offsets.append(offset)
+            offset += len(normalized) + 1
+
+        # Page pre-filter: a label can only contain a field name if the page
+        # text contains that field's longest word. Ties go to the later word
+        # so "sampling datetime" doesn't anchor on the header row.
+        self._anchor_automaton = PatternAutomaton(max(reversed(n.split()), key=len) for n in normalized_fields)
+
+        self.resolve = lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve)
+
+    def mentions_field(self, normalized_label):
+        """True when any analyte field name occurs inside the normalized label."""
+        return self._field_automaton.contains_any(normalized_label)
+
+    def page_may_match(self, normalized_text):
+        """Cheap check that a page's text could hold a table this resolver keeps."""
+        return self._anchor_automaton.contains_any(normalized_text)
+
+    def _fuzzy_match(self, normalized_analyte):
+        candidates = self._field_automaton.matches(normalized_analyte)
+        position = self._joined_fields.find(normalized_analyte)
+        if position != -1:
+            candidates.add(bisect_right(self._field_offsets, position) - 1)
+        if not candidates:
+            return None
+        return self.analyte_fields[min(candidates)]
+
+    def _resolve(self, analyte):
+        normalized_analyte = normalize(analyte)
+
+        # Skip blank or known non-analyte labels
+        if not analyte or normalized_analyte in SKIP_LABELS or NON_ANALYTE_AUTOMATON.contains_any(normalized_analyte):
+            return Resolution(normalized_analyte, None, True)
+
+        logging.info(f"Analyte label identified: {analyte}, Normalised: {normalized_analyte}")
+
+        # Strict match
+        match = self._strict_index.get(normalized_analyte)
+
+        # Match on CAS number if abbreviation fails
+        if not match:
+            logging.info(f"No strict match for {analyte}")
+            for cas in CAS_PATTERN.findall(analyte):
+                match = self._cas_index.get(cas)
+                if match:
+                    logging.info(f"CAS matched: {cas} → {match}")
+                    break
+
+        # Check for known partial match
+        if not match:
+            logging.info(f"No CAS match for {analyte}")
+            match = PARTIAL_MATCH_MAP.get(normalized_analyte)
+            if match:
+                logging.info(f"Partial match override: '{analyte}' → '{match}'")
+
+        # Match abbreviation if fuzzy fails
+        if not match:
+            logging.info(f"No partial match identified for {analyte}")
+            for abbrev in ABBREV_PATTERN.findall(normalized_analyte):
+                match = self._abbrev_index.get(abbrev)
+                if match:
+                    logging.info(f"Abbreviation matched: {abbrev} → {match}")
+                    break
+
+        # Then fuzzy fallback if analyte is long enough
+        if not match and len(normalized_analyte) > 10:
+            match = self._fuzzy_match(normalized_analyte)
+
+        return Resolution(normalized_analyte, match, False)
+
+
+class _ResolverTable(dict):
+    """Builds a query_type's resolver the first time it is looked up, so a
+    worker only pays for the query types it actually serves."""
+
+    def __missing__(self, query_type):
+        resolver = self[query_type] = AnalyteResolver(query_type)
+        return resolver
+
+
+RESOLVERS = _ResolverTable()
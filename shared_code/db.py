@@ -0,0 +1,253 @@
+import os
+import time
+import random
+import logging
+from functools import lru_cache
+from itertools import chain, islice
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from shared_code import timing
+
+# SQL Server caps a VALUES list at 1000 rows and a statement at 2100 parameters
+SQL_MAX_ROWS = 1000
+SQL_MAX_PARAMS = 2100
+
+# "insert" appends every row; "merge" upserts on sample location and date/time
+LOAD_MODES = ("insert", "merge")
+
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+
+_engine = None
+
+
+def get_engine():
+    """Return the process-wide engine, creating it on first use.
+
+    The engine's connection pool survives across warm invocations, so only
+    a cold worker pays for the SQL Server login. SQL_CONNECTION_URL
+    overrides the SQL_* settings, e.g. to point at a local stand-in.
+    """
+    global _engine
+    if _engine is None:
+        url = os.environ.get("SQL_CONNECTION_URL") or URL.create(
+            "mssql+pymssql",
+            username=os.environ["SQL_USER"],
+            password=os.environ["SQL_PASSWORD"],
+            host=os.environ["SQL_SERVER"],
+            database=os.environ["SQL_DB_LAB"],
+        )
+        _engine = create_engine(url, pool_pre_ping=True, pool_recycle=1800)
+    return _engine
+
+
+def chunk_size(column_count):
+    """Rows per INSERT statement that stay inside SQL Server's limits."""
+    return max(1, min(SQL_MAX_ROWS, (SQL_MAX_PARAMS - 1) // column_count))
+
+
+def _insert_statement(table_name, target_fields, row_count):
+    columns_sql = ", ".join([f"[{f}]" for f in target_fields])
+    values_sql = ", ".join(
+        "(" + ", ".join(f":p{r}_{c}" for c in range(len(target_fields))) + ")"
+        for r in range(row_count)
+    )
+    return text(f"INSERT INTO {table_name} ({columns_sql}) VALUES {values_sql}")
+
+
+@lru_cache(maxsize=64)
+def _param_names(row_count, column_count):
+    return tuple(f"p{r}_{c}" for r in range(row_count) for c in range(column_count))
+
+
+def _bind(rows):
+    return dict(zip(_param_names(len(rows), len(rows[0])), chain.from_iterable(rows)))
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_with_retry(operation, max_retries=MAX_RETRIES):
+    """Run ``operation`` and retry transient connection failures with
+    jittered exponential backoff."""
+    for attempt in range(max_retries):
+        try:
+            return operation()
+        except (OperationalError, InterfaceError):
+            if attempt >= max_retries - 1:
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logging.warning(f"Retrying DB operation in {delay:.1f} seconds... Attempt {attempt + 1}")
+            timing.count("db_retries")
+            time.sleep(delay)
+
+
+def _insert_rows(conn, table_name, target_fields, rows):
+    """Insert parameterized rows in batches on an open transaction."""
+    size = chunk_size(len(target_fields))
+    statements = {}
+    inserted = 0
+    for batch in _batches(rows, size):
+        if len(batch) not in statements:
+            statements[len(batch)] = _insert_statement(table_name, target_fields, len(batch))
+        conn.execute(statements[len(batch)], _bind(batch))
+        inserted += len(batch)
+    logging.info(f"Inserted {inserted} rows into {table_name} in batches of {size}")
+    return {"inserted": inserted}
+
+
+# Columns that identify a sample result; File Name is carried along but
+# is not part of the key
+MERGE_KEY_FIELDS = ("Sample Location", "Sampling Date/Time")
+ORDER_COLUMN = "_row_order"
+
+
+def _quoted(fields):
+    return ", ".join(f"[{f}]" for f in fields)
+
+
+def _key_match(left, right):
+    return " AND ".join(
+        f"({left}.[{k}] = {right}.[{k}] OR ({left}.[{k}] IS NULL AND {right}.[{k}] IS NULL))"
+        for k in MERGE_KEY_FIELDS
+    )
+
+
+def _stage_rows(conn, staging_name, target_fields, rows):
+    staged_fields = list(target_fields) + [ORDER_COLUMN]
+    size = chunk_size(len(staged_fields))
+    order = 0
+    for batch in _batches(rows, size):
+        for row in batch:
+            row.append(order)
+            order += 1
+        conn.execute(_insert_statement(staging_name, staged_fields, len(batch)), _bind(batch))
+
+
+def _merge_mssql_sql(table_name, target_fields, staging):
+    """MERGE from the staging table, selecting (inserted, updated, staged).
+
+    Earlier insert-mode loads can leave several target rows per key, and
+    MERGE outputs an action for each of them. Updates are therefore
+    counted per staged row, so every staged key is exactly one of
+    inserted, updated or unchanged.
+    """
+    value_fields = [f for f in target_fields if f not in MERGE_KEY_FIELDS]
+    # Later rows for the same key win; results only overwrite with non-NULL values
+    source = (
+        f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {_quoted(MERGE_KEY_FIELDS)} "
+        f"ORDER BY [{ORDER_COLUMN}] DESC) AS [_rn] FROM {staging}) AS d WHERE [_rn] = 1"
+    )
+    changed = (
+        f"EXISTS (SELECT {', '.join(f'COALESCE(s.[{f}], t.[{f}])' for f in value_fields)} "
+        f"EXCEPT SELECT {', '.join(f't.[{f}]' for f in value_fields)})"
+    )
+    return f"""
+        SET NOCOUNT ON;
+        DECLARE @actions TABLE ([action] nvarchar(10), [{ORDER_COLUMN}] int);
+        MERGE {table_name} WITH (HOLDLOCK) AS t
+        USING ({source}) AS s
+        ON {_key_match('t', 's')}
+        WHEN MATCHED AND {changed} THEN
+            UPDATE SET {', '.join(f't.[{f}] = COALESCE(s.[{f}], t.[{f}])' for f in value_fields)}
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({_quoted(target_fields)}) VALUES ({', '.join(f's.[{f}]' for f in target_fields)})
+        OUTPUT $action, s.[{ORDER_COLUMN}] INTO @actions;
+        SELECT
+            (SELECT COUNT(*) FROM @actions WHERE [action] = 'INSERT'),
+            (SELECT COUNT(DISTINCT [{ORDER_COLUMN}]) FROM @actions WHERE [action] = 'UPDATE'),
+            (SELECT COUNT(*) FROM ({source}) AS staged);
+    """
+
+
+def _merge_mssql(conn, table_name, target_fields, rows):
+    staging = "#lab_staging"
+    conn.execute(text(f"IF OBJECT_ID('tempdb..{staging}') IS NOT NULL DROP TABLE {staging}"))
+    conn.execute(text(
+        f"SELECT TOP 0 {_quoted(target_fields)}, CAST(0 AS int) AS [{ORDER_COLUMN}] "
+        f"INTO {staging} FROM {table_name}"
+    ))
+    _stage_rows(conn, staging, target_fields, rows)
+    result = conn.execute(text(_merge_mssql_sql(table_name, target_fields, staging))).one()
+    conn.execute(text(f"DROP TABLE {staging}"))
+    inserted, updated, staged = result
+    return inserted, updated, staged
+
+
+def _merge_generic(conn, table_name, target_fields, rows):
+    # Stand-in for dialects without MERGE (e.g. SQLite for local testing),
+    # same semantics as _merge_mssql in an UPDATE ... FROM plus INSERT.
+    staging = "lab_staging"
+    value_fields = [f for f in target_fields if f not in MERGE_KEY_FIELDS]
+    conn.execute(text(f"DROP TABLE IF EXISTS temp.{staging}"))
+    conn.execute(text(
+        f"CREATE TEMP TABLE {staging} AS SELECT {_quoted(target_fields)}, 0 AS [{ORDER_COLUMN}] "
+        f"FROM {table_name} WHERE 0 = 1"
+    ))
+    _stage_rows(conn, staging, target_fields, rows)
+    conn.execute(text(
+        f"DELETE FROM {staging} WHERE EXISTS (SELECT 1 FROM {staging} AS later "
+        f"WHERE {_key_match('later', staging)} AND later.[{ORDER_COLUMN}] > {staging}.[{ORDER_COLUMN}])"
+    ))
+    staged = conn.execute(text(f"SELECT COUNT(*) FROM {staging}")).scalar()
+
+    changed = " OR ".join(f"(s.[{f}] IS NOT NULL AND s.[{f}] IS NOT t.[{f}])" for f in value_fields)
+    # Counted per staged key, as target rows can repeat a key
+    updated = conn.execute(text(
+        f"SELECT COUNT(*) FROM {staging} AS s WHERE EXISTS "
+        f"(SELECT 1 FROM {table_name} AS t WHERE {_key_match('t', 's')} AND ({changed}))"
+    )).scalar()
+    conn.execute(text(
+        f"UPDATE {table_name} AS t SET {', '.join(f'[{f}] = COALESCE(s.[{f}], t.[{f}])' for f in value_fields)} "
+        f"FROM {staging} AS s WHERE {_key_match('t', 's')} AND ({changed})"
+    ))
+    inserted = conn.execute(text(
+        f"INSERT INTO {table_name} ({_quoted(target_fields)}) SELECT {_quoted(target_fields)} FROM {staging} AS s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} AS t WHERE {_key_match('t', 's')})"
+    )).rowcount
+    conn.execute(text(f"DROP TABLE {staging}"))
+    return inserted, updated, staged
+
+
+def _merge_rows(conn, table_name, target_fields, rows):
+    """Load rows into a session staging table and merge them into the target.
+
+    Rows are matched on sample location and sampling date/time, so
+    re-uploading a report leaves the table unchanged. Returns a dict of
+    inserted, updated and unchanged counts.
+    """
+    if conn.dialect.name == "mssql":
+        inserted, updated, staged = _merge_mssql(conn, table_name, target_fields, rows)
+    else:
+        inserted, updated, staged = _merge_generic(conn, table_name, target_fields, rows)
+    counts = {"inserted": inserted, "updated": updated, "unchanged": staged - inserted - updated}
+    logging.info(f"Merged {staged} staged rows into {table_name}: {counts}")
+    return counts
+
+
+def load_tables(groups, load_mode="insert"):
+    """Write rows for one or more tables in a single transaction.
+
+    ``groups`` maps a table name to the RowBuffers loaded into it, all of
+    the same query_type. Returns the insert or merge counts per table.
+    """
+    load = _merge_rows if load_mode == "merge" else _insert_rows
+
+    def run():
+        with get_engine().begin() as conn:
+            return {
+                table_name: load(conn, table_name, buffers[0].fields, chain.from_iterable(b.param_rows() for b in buffers))
+                for table_name, buffers in groups.items()
+            }
+
+    return run_with_retry(run)
@@ -0,0 +1,371 @@
+import io
+import csv
+import json
+import time
+import base64
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from shared_code import int_setting, timing
+from shared_code.analytes import FIELD_MAP, QUERY_TYPE_TO_TABLE
+
+# App settings for GET exports: default page size and the per-worker cache
+# of recently served pages (a TTL of 0 disables it)
+PAGE_SIZE_SETTING = "EXPORT_PAGE_SIZE"
+CACHE_TTL_SETTING = "EXPORT_CACHE_TTL"
+CACHE_SIZE_SETTING = "EXPORT_CACHE_SIZE"
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+DEFAULT_CACHE_TTL = 30
+DEFAULT_CACHE_ENTRIES = 64
+# Pages bigger than this are served but not kept
+CACHE_MAX_BYTES = 4 * 2**20
+
+# Rows pulled from the cursor and encoded per round trip
+FETCH_SIZE = 500
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Keyset order, on the raw columns so an index over them can seek; NULLs
+# sort first on SQL Server and SQLite alike. Rows sharing a key (a report
+# loaded twice, or two revisions under one file name) are read as a group
+# and ordered on every column, so a cursor can point into a group.
+KEY_FIELDS = ("Sample Location", "Sampling Date/Time", "File Name")
+
+# How sampling date/times appear in ALS reports, for dialects that can't
+# convert them in SQL
+SAMPLE_DATETIME_FORMATS = ("%d-%b-%Y %H:%M", "%d-%b-%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class QueryError(ValueError):
+    """Raised for missing or invalid export parameters."""
+
+
+class ExportQuery(NamedTuple):
+    query_type: str
+    location: Optional[str]
+    file_name: Optional[str]
+    date_from: Optional[datetime]
+    date_to: Optional[datetime]
+    format: str
+    limit: int
+    after: Optional[tuple]  # KEY_FIELDS values of the last key group reached
+    skip: int  # rows of that group already sent, 0 once all of it was
+
+
+def _parse_bound(value, name, end_of_day):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        bound = datetime.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"{name} must be an ISO date or date/time") from None
+    if bound.tzinfo is not None:
+        raise QueryError(f"{name} must not have a UTC offset; sampling times are local")
+    # A bare date_to includes the whole day
+    if end_of_day and len(value) == 10:
+        bound = datetime.combine(bound.date(), dt_time.max)
+    return bound
+
+
+def encode_cursor(key, skip):
+    return base64.urlsafe_b64encode(json.dumps([*key, skip]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(token):
+    if not token:
+        return None, 0
+    try:
+        *key, skip = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if len(key) != len(KEY_FIELDS) or not all(k is None or isinstance(k, str) for k in key) or not isinstance(skip, int) or skip < 0:
+            raise ValueError(token)
+    except (ValueError, TypeError):
+        raise QueryError("Invalid cursor") from None
+    return tuple(key), skip
+
+
+def parse_query(params, accept=""):
+    """Build an ExportQuery from GET parameters, raising QueryError.
+
+    ``format`` falls back to the Accept header, then NDJSON. ``date_from``
+    and ``date_to`` are inclusive ISO dates or date/times.
+    """
+    query_type = params.get("query_type", "").strip().lower()
+    if query_type not in FIELD_MAP:
+        raise QueryError("Invalid or missing query_type")
+
+    output_format = params.get("format", "").strip().lower() or ("csv" if "text/csv" in accept else "ndjson")
+    if output_format not in FORMATS:
+        raise QueryError(f"Invalid format: {output_format}")
+
+    try:
+        limit = int(params.get("limit") or int_setting(PAGE_SIZE_SETTING, DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise QueryError("limit must be an integer") from None
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise QueryError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    after, skip = _decode_cursor(params.get("cursor"))
+    return ExportQuery(
+        query_type=query_type,
+        location=params.get("location", "").strip() or None,
+        file_name=params.get("file_name", "").strip() or None,
+        date_from=_parse_bound(params.get("date_from"), "date_from", end_of_day=False),
+        date_to=_parse_bound(params.get("date_to"), "date_to", end_of_day=True),
+        format=output_format,
+        limit=limit,
+        after=after,
+        skip=skip,
+    )
+
+
+def _key_params(key):
+    return {f"key{i}": value for i, value in enumerate(key) if value is not None}
+
+
+def _after_condition(key):
+    # (k0, k1, k2) > key in NULLs-first order, spelled out for SQL Server
+    condition = None
+    for i in reversed(range(len(KEY_FIELDS))):
+        column = f"[{KEY_FIELDS[i]}]"
+        greater = f"{column} IS NOT NULL" if key[i] is None else f"{column} > :key{i}"
+        if condition is None:
+            condition = greater
+        else:
+            equal = f"{column} IS NULL" if key[i] is None else f"{column} = :key{i}"
+            condition = f"{greater} OR ({equal} AND ({condition}))"
+    return f"({condition})"
+
+
+def _group_condition(key):
+    return " AND ".join(
+        f"[{field}] IS NULL" if value is None else f"[{field}] = :key{i}"
+        for i, (field, value) in enumerate(zip(KEY_FIELDS, key))
+    )
+
+
+def _select(query, dialect, group=None, row_limit=None):
+    """SQL and parameters for ``query``'s rows past its cursor, or for the
+    rows of one key ``group``, in key order.
+
+    SQL Server converts the sampling date/time with TRY_CONVERT and stops
+    after ``row_limit`` rows with TOP. Other dialects (e.g. SQLite for
+    local testing) can't parse ALS dates, so a date range is applied in
+    Python while reading, without a LIMIT. Returns (sql, params, filter
+    dates in Python).
+    """
+    fields = FIELD_MAP[query.query_type]
+    conditions, params = [], {}
+    if query.location:
+        conditions.append("[Sample Location] = :location")
+        params["location"] = query.location
+    if query.file_name:
+        conditions.append("[File Name] = :file_name")
+        params["file_name"] = query.file_name
+    if group is not None:
+        conditions.append(_group_condition(group))
+        params.update(_key_params(group))
+    elif query.after:
+        conditions.append(_after_condition(query.after))
+        params.update(_key_params(query.after))
+
+    has_dates = query.date_from is not None or query.date_to is not None
+    mssql = dialect == "mssql"
+    if mssql:
+        sample_datetime = "TRY_CONVERT(datetime2, [Sampling Date/Time])"
+        if query.date_from is not None:
+            conditions.append(f"{sample_datetime} >= :date_from")
+            params["date_from"] = query.date_from
+        if query.date_to is not None:
+            conditions.append(f"{sample_datetime} <= :date_to")
+            params["date_to"] = query.date_to
+
+    limited = row_limit is not None and (mssql or not has_dates)
+    if limited:
+        params["row_limit"] = row_limit
+    sql = (
+        f"SELECT {'TOP (:row_limit) ' if limited and mssql else ''}{', '.join(f'[{f}]' for f in fields)} "
+        f"FROM {QUERY_TYPE_TO_TABLE[query.query_type]}"
+        + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+        + f" ORDER BY {', '.join(f'[{f}]' for f in KEY_FIELDS)}"
+        + (" LIMIT :row_limit" if limited and not mssql else "")
+    )
+    return sql, params, has_dates and not mssql
+
+
+def _sample_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    for fmt in SAMPLE_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _in_range(value, query):
+    sampled = _sample_datetime(value)
+    if sampled is None:
+        return False
+    return (query.date_from is None or sampled >= query.date_from) and (query.date_to is None or sampled <= query.date_to)
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode(output_format, fields, rows):
+    if output_format == "csv":
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        return out.getvalue().encode()
+    return "".join(
+        json.dumps(dict(zip(fields, row)), default=_json_value, ensure_ascii=False) + "\n" for row in rows
+    ).encode()
+
+
+def _row_order(row):
+    # Total order over a key group's rows; NULLs first, as in SQL
+    return tuple((value is not None, value if value is not None else 0) for value in row)
+
+
+def _key_comparer(dialect):
+    # SQL Server's default collation ignores case and trailing spaces, so
+    # its key groups do too
+    if dialect == "mssql":
+        return lambda value: value.casefold().rstrip() if isinstance(value, str) else value
+    return lambda value: value
+
+
+def read_page(query):
+    """Read and encode one page of rows for ``query``.
+
+    Rows come off the cursor FETCH_SIZE at a time and are encoded as their
+    key group completes, so only the encoded page and one group are held.
+    Each group is ordered on all of its columns, so rows sharing a key
+    come out in the same order on every request. When a page ends inside a
+    group, that group is re-read in full and the cursor records how far
+    into it the page got. Returns (body, next cursor or None, row count).
+    """
+    from sqlalchemy import text
+    from shared_code.db import get_engine, run_with_retry
+
+    fields = FIELD_MAP[query.query_type]
+    key_columns = [fields.index(f) for f in KEY_FIELDS]
+    date_column = fields.index("Sampling Date/Time")
+
+    def run():
+        with get_engine().connect() as conn:
+            comparable = _key_comparer(conn.dialect.name)
+
+            def read(group=None, row_limit=None):
+                sql, params, filter_dates = _select(query, conn.dialect.name, group, row_limit)
+                result = conn.execution_options(yield_per=FETCH_SIZE).execute(text(sql), params)
+                try:
+                    for partition in result.partitions():
+                        for row in partition:
+                            if not filter_dates or _in_range(row[date_column], query):
+                                yield tuple(row)
+                finally:
+                    result.close()
+
+            def read_group(key):
+                return sorted(read(group=key), key=_row_order)
+
+            body = bytearray(_encode(query.format, fields, [fields]) if query.format == "csv" else b"")
+            ready = []
+
+            def emit(rows):
+                ready.extend(rows)
+                if len(ready) >= FETCH_SIZE:
+                    body.extend(_encode(query.format, fields, ready))
+                    ready.clear()
+
+            def finish(next_cursor):
+                body.extend(_encode(query.format, fields, ready))
+                return bytes(body), next_cursor, query.limit - room
+
+            room = query.limit
+            last_key = query.after
+            if query.after and query.skip:
+                group = read_group(query.after)
+                rows = group[query.skip:query.skip + room]
+                emit(rows)
+                room -= len(rows)
+                if query.skip + len(rows) < len(group):
+                    return finish(encode_cursor(query.after, query.skip + len(rows)))
+
+            # One row past the page tells whether there is more
+            capacity, fetched, more = room, 0, False
+            pending, pending_key = [], None
+            page_rows = read(row_limit=capacity + 1)
+            for row in page_rows:
+                key = tuple(comparable(row[i]) for i in key_columns)
+                if pending and key != pending_key:
+                    emit(sorted(pending, key=_row_order))
+                    room -= len(pending)
+                    last_key = tuple(pending[0][i] for i in key_columns)
+                    pending = []
+                pending.append(row)
+                pending_key = key
+                fetched += 1
+                if fetched > capacity:
+                    more = True
+                    break
+            page_rows.close()
+
+            if not more:
+                emit(sorted(pending, key=_row_order))
+                room -= len(pending)
+                return finish(None)
+            if room == 0:
+                return finish(encode_cursor(last_key, 0))
+            # The page ends in the last group read, which may be cut short
+            key = tuple(pending[0][i] for i in key_columns)
+            group = read_group(key)
+            rows = group[:room]
+            emit(rows)
+            room -= len(rows)
+            return finish(encode_cursor(key, len(rows) if len(rows) < len(group) else 0))
+
+    return run_with_retry(run)
+
+
+def get_page(query):
+    """read_page, served from this worker's cache for EXPORT_CACHE_TTL
+    seconds. Repeated dashboard queries can see rows loaded by other
+    workers up to that much later."""
+    ttl = int_setting(CACHE_TTL_SETTING, DEFAULT_CACHE_TTL)
+    with _cache_lock:
+        entry = _cache.pop(query, None)
+        if entry is not None and entry[0] > time.monotonic():
+            _cache[query] = entry
+            timing.count("export_cache_hits")
+            return entry[1]
+
+    page = read_page(query)
+    if ttl > 0 and len(page[0]) <= CACHE_MAX_BYTES:
+        with _cache_lock:
+            _cache[query] = (time.monotonic() + ttl, page)
+            while len(_cache) > int_setting(CACHE_SIZE_SETTING, DEFAULT_CACHE_ENTRIES):
+                _cache.popitem(last=False)
+    return page
+
+
+def invalidate(table_names):
+    """Drop cached pages of tables this worker has just loaded."""
+    with _cache_lock:
+        for query in [q for q in _cache if QUERY_TYPE_TO_TABLE[q.query_type] in table_names]:
+            del _cache[query]
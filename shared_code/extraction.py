@@ -0,0 +1,339 @@
+import os
+import re
+import logging
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+
+from shared_code import int_setting, timing
+from shared_code.analytes import RESOLVERS, normalize
+from shared_code.intake import open_source, picklable_source
+from shared_code.layout_templates import extract_grid, learn_template, match_template, page_grid
+from shared_code.row_buffer import COLUMN_INDEX
+
+NUMERIC_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+
+# App settings controlling the page extraction pool
+WORKERS_SETTING = "PDF_EXTRACT_WORKERS"
+MIN_PAGES_SETTING = "PDF_EXTRACT_MIN_PAGES"
+PREFILTER_SETTING = "PDF_PAGE_PREFILTER"
+TEMPLATES_SETTING = "PDF_LAYOUT_TEMPLATES"
+DEFAULT_MIN_PAGES = 8
+DEFAULT_TEMPLATES = 8
+
+_pool = None
+_pool_workers = 0
+# Parse threads of a batch upload share the pool
+_pool_lock = threading.Lock()
+
+
+def clean_value(val):
+    """Parse a raw result cell into a float, or None for NULL."""
+    if not val:
+        return None
+    val = val.strip().replace("<", "").replace("~", "")
+    if val in ["", "-", "----"]:
+        return None
+    if NUMERIC_PATTERN.match(val):
+        return float(val)  # ✅ valid numeric
+    return None  # ❌ invalid for numeric column
+
+
+def plan_table_rows(table, resolver, min_width=0):
+    """Walk the analyte rows of a results table once.
+
+    Returns a list of (row index, matched field, value row) tuples. Rows
+    narrower than ``min_width`` are stepped over, the same way the
+    per-column walk skips rows that don't reach its column.
+    """
+    plan = []
+    unmatched = 0
+    i = 3
+    while i < len(table):
+        row = table[i]
+        if not row or len(row) < min_width:
+            i += 1
+            continue
+
+        # Stitch labels that wrap onto the following rows
+        analyte_lines = [row[0].strip()] if row[0] else []
+        j = i + 1
+        while j < len(table):
+            next_line = table[j][0] if table[j][0] else ''
+            next_line_stripped = next_line.strip()
+            if next_line_stripped == '' or re.match(r'^[A-Za-z()\\d\\s\\-]+$', next_line_stripped):
+                analyte_lines.append(next_line_stripped)
+                j += 1
+            else:
+                break
+            if j < len(table):
+                analyte_lines.append(table[j][0].strip() if table[j][0] else '')
+            j += 1
+
+        analyte = ' '.join(analyte_lines).strip()
+        resolution = resolver.resolve(analyte)
+        normalized_analyte = resolution.normalized
+
+        # Skip blank or known non-analyte labels
+        if resolution.skipped:
+            logging.info(f"Skipping non-analyte label: '{analyte}' (normalized: '{normalized_analyte}')")
+            i = j
+            continue
+
+        match = resolution.match
+        logging.info({
+            "analyte_raw": analyte,
+            "matched": match,
+            "row_index": i
+        })
+
+        if not match:
+            logging.warning(f"Unmatched analyte: '{analyte}' (normalized: '{normalized_analyte}')")
+            unmatched += 1
+            i = j
+            continue
+
+        val_row = table[j - 1] if j - 1 < len(table) else table[i]
+        plan.append((i, match, val_row))
+        i = j
+
+    timing.count("analytes_matched", len(plan))
+    timing.count("analytes_unmatched", unmatched)
+    return plan
+
+
+def table_has_analytes(table, resolver):
+    analyte_labels = [normalize(r[0]) for r in table[3:] if r and r[0]]
+    return any(resolver.mentions_field(a) for a in analyte_labels)
+
+
+def extract_table_rows(table, resolver, combined_rows, table_index=0):
+    """Merge one extracted table into ``combined_rows``, a RowBuffer.
+
+    Row labels are resolved once per table and the resulting plan is then
+    swept across every sample column. Returns False when the table was
+    skipped.
+    """
+    if not table or len(table) < 3:
+        return False
+
+    # Skip tables that contain no known analytes
+    if not table_has_analytes(table, resolver):
+        logging.info(f"Skipping table {table_index} (no analytes found)")
+        return False
+
+    sample_locations = table[0][3:]
+    sample_datetimes = table[1][3:]
+
+    # Every column can share one plan unless the table is ragged, in which
+    # case columns past the shortest row get a plan of their own.
+    row_widths = [len(r) for r in table[3:] if r]
+    shared_width = min(row_widths) if row_widths else 0
+    sweeps = {}
+    # The partial-match overrides can name a field of another query_type;
+    # there's no column to write it to, so it is dropped here
+    columns = COLUMN_INDEX[combined_rows.query_type]
+
+    def sweep_for(width):
+        if width <= shared_width:
+            width = 0
+        if width not in sweeps:
+            sweeps[width] = [
+                (columns[match], [clean_value(v) for v in val_row[3:]])
+                for _, match, val_row in plan_table_rows(table, resolver, width)
+                if match in columns
+            ]
+        return sweeps[width]
+
+    for col_index, sample_location in enumerate(sample_locations):
+        if not sample_location or sample_location.strip() == '----':
+            continue
+
+        date_val = sample_datetimes[col_index] if col_index < len(sample_datetimes) else None
+        sample_location = sample_location.strip()
+        sample_datetime = date_val.strip() if date_val else None
+
+        row = combined_rows.row(sample_location, sample_datetime)
+        for column, values in sweep_for(col_index + 4):
+            combined_rows.set(row, column, values[col_index] if col_index < len(values) else None)
+
+    return True
+
+
+def extract_page(page, resolver, stats, prefilter=True, max_templates=DEFAULT_TEMPLATES):
+    """Run table detection on a single pdfplumber page.
+
+    Pages without any ruling lines cannot produce a table, and pages whose
+    text never mentions a field of the query_type cannot produce a table
+    that extract_table_rows keeps, so both skip table detection. Pages that
+    match a learned layout template are cut straight from their grid. The
+    page's cached layout objects are released before returning.
+    """
+    stats["pages"] += 1
+    try:
+        # pdfminer lays out the whole page on first access to any of its
+        # objects; timed apart so prefilter only covers the text check
+        with timing.stage("layout"):
+            page.objects
+        with timing.stage("prefilter"):
+            if prefilter and not page.edges:
+                stats["pages_skipped_no_lines"] += 1
+                return []
+            if prefilter and not resolver.page_may_match(normalize(page.extract_text())):
+                stats["pages_skipped_no_analytes"] += 1
+                return []
+        stats["pages_extracted"] += 1
+
+        with timing.stage("extract_tables"):
+            grid = page_grid(page) if max_templates > 0 else None
+            if grid and match_template(page, grid):
+                stats["pages_template_hits"] += 1
+                return [extract_grid(page, *grid)]
+
+            tables = page.extract_tables()
+            if grid and len(tables) == 1 and len(tables[0]) >= 3 and table_has_analytes(tables[0], resolver):
+                learn_template(page, grid, tables[0], max_templates)
+            return tables
+    finally:
+        page.flush_cache()
+
+
+def _open_pdf(fp):
+    with timing.stage("pdf_open"):
+        return pdfplumber.open(fp)
+
+
+def _extract_pages(pdf, pages, resolver, stats, prefilter, max_templates):
+    for page_number in pages:
+        logging.info(f"Processing page {page_number + 1}...")
+        yield page_number, extract_page(pdf.pages[page_number], resolver, stats, prefilter, max_templates)
+
+
+def _extract_page_range(file_content, query_type, start, stop, prefilter, max_templates):
+    """Pool worker: open the PDF independently and extract a run of pages.
+    ``file_content`` is the PDF bytes or the SpilledFile it was written to.
+    The worker's stage timings and counters are returned with its pages."""
+    stats = Counter()
+    timer = timing.RequestTimer("page-range")
+    with timing.activate(timer), open_source(file_content) as fp, _open_pdf(fp) as pdf:
+        results = list(_extract_pages(pdf, range(start, stop), RESOLVERS[query_type], stats, prefilter, max_templates))
+    return results, stats, (timer.durations, timer.counters)
+
+
+def _pool_context():
+    # The Functions worker runs gRPC, logging and parse threads, and a lock
+    # held by any of them when it forks would stay held in the child. Pool
+    # workers start from a forkserver instead, with this module preloaded.
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _submit(workers, calls):
+    """Submit (function, *args) calls to the shared pool; returns the pool
+    and the futures in call order.
+
+    The pool is kept alive across warm invocations so only the first
+    pooled PDF pays for process startup. It is created and replaced under
+    a lock, so a pool can't be shut down by another thread between being
+    fetched and being submitted to.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+            _pool_workers = workers
+        try:
+            return _pool, [_pool.submit(*call) for call in calls]
+        except BrokenProcessPool:
+            _pool.shutdown(wait=False)
+            _pool = None
+            raise
+
+
+def _reset_pool(broken):
+    """Drop ``broken``, unless another thread has already replaced it."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def iter_page_tables(file_content, query_type, stats=None, progress=None, concurrent=False):
+    """Yield (page number, tables) for every page of the PDF, in page order.
+
+    Large PDFs are sharded into contiguous page ranges across a process
+    pool sized by the PDF_EXTRACT_WORKERS app setting. PDFs with fewer than
+    PDF_EXTRACT_MIN_PAGES pages, or a pool of one worker, run serially,
+    unless ``concurrent`` says other files are being parsed on other
+    threads. Those small PDFs go to the pool as one whole-file shard
+    instead, since pdfplumber threads would only contend for the GIL.
+    PDF_LAYOUT_TEMPLATES sets how many layout templates each worker keeps
+    (0 disables them). Page counters are accumulated into ``stats`` when
+    given. ``progress(pages_done, page_count)`` is called as each page is
+    yielded, or as each shard finishes when the pool is used.
+    """
+    stats = Counter() if stats is None else stats
+    resolver = RESOLVERS[query_type]
+    workers = int_setting(WORKERS_SETTING, os.cpu_count() or 1)
+    min_pages = int_setting(MIN_PAGES_SETTING, DEFAULT_MIN_PAGES)
+    prefilter = int_setting(PREFILTER_SETTING, 1) != 0
+    max_templates = int_setting(TEMPLATES_SETTING, DEFAULT_TEMPLATES)
+
+    def tracked(pages):
+        for pages_done, page in enumerate(pages, 1):
+            if progress:
+                progress(pages_done, page_count)
+            yield page
+
+    with open_source(file_content) as fp, _open_pdf(fp) as pdf:
+        page_count = len(pdf.pages)
+        small = page_count < max(min_pages, 2)
+        if workers <= 1 or (small and not concurrent):
+            yield from tracked(_extract_pages(pdf, range(page_count), resolver, stats, prefilter, max_templates))
+            return
+
+    shard_size = max(1, page_count if small else -(-page_count // workers))
+    shards = [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+    logging.info(f"Extracting {page_count} pages across {len(shards)} workers...")
+
+    pool = None
+    try:
+        shared_source = picklable_source(file_content)
+        pool, futures = _submit(workers, [
+            (_extract_page_range, shared_source, query_type, start, stop, prefilter, max_templates)
+            for start, stop in shards
+        ])
+        # Pages are yielded in order once every shard is back, but progress
+        # moves as each shard finishes
+        shard_index = {future: index for index, future in enumerate(futures)}
+        results = [None] * len(shards)
+        pages_done = 0
+        for future in as_completed(futures):
+            results[shard_index[future]] = future.result()
+            pages_done += len(results[shard_index[future]][0])
+            if progress:
+                progress(pages_done, page_count)
+    except BrokenProcessPool:
+        logging.warning("Page extraction pool failed, falling back to serial extraction")
+        _reset_pool(pool)
+        with open_source(file_content) as fp, _open_pdf(fp) as pdf:
+            yield from tracked(_extract_pages(pdf, range(page_count), resolver, stats, prefilter, max_templates))
+        return
+
+    timer = timing.current()
+    for shard, shard_stats, shard_timings in results:
+        stats.update(shard_stats)
+        if timer is not None:
+            timer.merge(*shard_timings)
+    for shard, _, _ in results:
+        yield from shard
@@ -0,0 +1,190 @@
+import io
+import os
+import re
+import logging
+import tempfile
+from typing import NamedTuple
+
+from shared_code import int_setting, timing
+
+# App setting: PDF parts larger than this many bytes are spilled to disk.
+# The request body stays in memory either way, so spilling doesn't lower
+# peak memory; it lets pool workers open the PDF by path instead of
+# receiving a pickled copy of its bytes.
+SPILL_BYTES_SETTING = "UPLOAD_SPILL_BYTES"
+DEFAULT_SPILL_BYTES = 10 * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+BOUNDARY_PATTERN = re.compile(r'boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class SpilledFile(NamedTuple):
+    path: str
+    size: int
+
+
+class Part(NamedTuple):
+    headers: dict
+    content: memoryview
+
+    @property
+    def content_disposition(self):
+        return self.headers.get("content-disposition", "")
+
+    @property
+    def text(self):
+        return bytes(self.content).decode("utf-8")
+
+
+class MemoryViewReader(io.RawIOBase):
+    """Seekable read-only file over a buffer, so pdfplumber can read an
+    upload without it being copied into a BytesIO first."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if self._pos < 0:
+            raise ValueError("Negative seek position")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def open_source(source):
+    """Open an upload's content, a buffer or a SpilledFile, as a binary file."""
+    if isinstance(source, SpilledFile):
+        return open(source.path, "rb")
+    return MemoryViewReader(source)
+
+
+def iter_source_chunks(source, size=CHUNK_SIZE):
+    if isinstance(source, SpilledFile):
+        with open(source.path, "rb") as f:
+            for chunk in iter(lambda: f.read(size), b""):
+                yield chunk
+    else:
+        view = memoryview(source)
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+
+
+def read_source(source):
+    if isinstance(source, SpilledFile):
+        with open(source.path, "rb") as f:
+            return f.read()
+    return bytes(source)
+
+
+def picklable_source(source):
+    """Form of the source that can be sent to a worker process. Spilled
+    files travel as their path; buffers have to be copied."""
+    return source if isinstance(source, SpilledFile) else bytes(source)
+
+
+def _parse_headers(block):
+    headers = {}
+    for line in bytes(block).decode("utf-8", "replace").split("\r\n"):
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def iter_parts(body, content_type):
+    """Split a multipart/form-data body into parts.
+
+    Part contents are memoryview slices of ``body``, so no part is copied.
+    """
+    match = BOUNDARY_PATTERN.search(content_type)
+    if not match:
+        raise MultipartError("Missing multipart boundary")
+    delimiter = b"--" + (match.group(1) or match.group(2)).encode()
+    view = memoryview(body)
+
+    # The first delimiter starts the body or a line after the preamble
+    if body.startswith(delimiter):
+        start = 0
+    else:
+        start = body.find(b"\r\n" + delimiter)
+        if start == -1:
+            raise MultipartError("Multipart boundary not found in body")
+        start += 2
+    while True:
+        start += len(delimiter)
+        if body[start:start + 2] == b"--":
+            return
+        if body[start:start + 2] != b"\r\n":
+            raise MultipartError("Malformed multipart boundary line")
+        # A part may have no headers, leaving the blank line straight after
+        # the boundary line
+        header_end = body.find(b"\r\n\r\n", start)
+        if header_end == -1:
+            raise MultipartError("Unterminated multipart headers")
+        end = body.find(b"\r\n" + delimiter, header_end + 4)
+        if end == -1:
+            raise MultipartError("Unterminated multipart part")
+        yield Part(_parse_headers(view[start + 2:header_end]), view[header_end + 4:end])
+        start = end + 2
+
+
+class Intake:
+    """Uploaded PDFs for one request; large ones are spilled to temporary
+    files that are removed by close()."""
+
+    def __init__(self):
+        self.spill_bytes = int_setting(SPILL_BYTES_SETTING, DEFAULT_SPILL_BYTES)
+        self._spilled = []
+
+    def keep(self, content):
+        """Return the source to hand to the pipeline for a PDF part.
+
+        Large parts are written to a temp file. That costs disk I/O and
+        saves no memory, since the request still holds the whole body,
+        but extraction workers then get a path rather than the bytes.
+        """
+        if len(content) <= self.spill_bytes:
+            return content
+        with tempfile.NamedTemporaryFile(prefix="lab-data-", suffix=".pdf", delete=False) as f:
+            f.write(content)
+        self._spilled.append(f.name)
+        timing.count("spilled_bytes", len(content))
+        logging.info(f"Spilled {len(content)} byte upload to {f.name}")
+        return SpilledFile(f.name, len(content))
+
+    def close(self):
+        for path in self._spilled:
+            try:
+                os.remove(path)
+            except OSError:
+                logging.warning(f"Could not remove spilled upload {path}")
+        self._spilled = []
+
@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from shared_code import timing
+from shared_code.intake import open_source, read_source
+
+# "storage" keeps jobs in Blob storage and queues them for the lab-data-worker
+# function; "local" runs them on a background thread in this process
+JOB_STORE_SETTING = "JOB_STORE"
+STORAGE_CONNECTION_SETTING = "AzureWebJobsStorage"
+JOB_QUEUE_NAME = "lab-data-jobs"
+JOB_CONTAINER_NAME = "lab-data-jobs"
+
+# Minimum seconds between progress writes while a job is parsing
+PROGRESS_INTERVAL = 2.0
+
+# Hours a job record stays readable; its PDFs are deleted once it finishes
+RETENTION_SETTING = "JOB_RETENTION_HOURS"
+DEFAULT_RETENTION_HOURS = 24
+# Minimum seconds between sweeps for expired jobs
+PURGE_INTERVAL = 3600
+
+# Deliveries of a queue message before it moves to the poison queue; the
+# same as maxDequeueCount in host.json
+MAX_DEQUEUE_COUNT = 5
+
+# uuid4().hex, checked before a job id goes into a blob name
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+TERMINAL_STATUSES = ("success", "partial", "failed")
+
+_store = None
+_last_purge = 0.0
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class LocalJobStore:
+    """In-process stand-in for local testing: jobs live in memory and a
+    daemon thread drains the queue."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def save_files(self, job_id, contents):
+        # Spilled uploads are removed when the request ends, so take a copy
+        self._files[job_id] = [read_source(content) for content in contents]
+
+    def load_files(self, job_id):
+        return self._files[job_id]
+
+    def delete_files(self, job_id):
+        self._files.pop(job_id, None)
+
+    def purge(self, cutoff):
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job["updated"] < cutoff.isoformat()]:
+                del self._jobs[job_id]
+                self._files.pop(job_id, None)
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["job_id"]] = json.loads(json.dumps(job))
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def enqueue(self, job_id):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._drain, name="lab-data-jobs", daemon=True)
+            self._worker.start()
+        self._queue.put(job_id)
+
+    def _drain(self):
+        while True:
+            try:
+                run_job(self._queue.get(), self)
+            except Exception:
+                pass  # run_job logged it and marked the job failed
+
+
+class StorageJobStore:
+    """Job records and uploaded PDFs in Blob storage, job ids on a Storage
+    queue. Works the same against the Azurite emulator."""
+
+    def __init__(self, connection_string):
+        from azure.storage.blob import BlobServiceClient
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+        self._container = BlobServiceClient.from_connection_string(connection_string).get_container_client(JOB_CONTAINER_NAME)
+        # Queue triggers expect base64 encoded messages by default
+        self._queue = QueueClient.from_connection_string(connection_string, JOB_QUEUE_NAME, message_encode_policy=TextBase64EncodePolicy())
+        self._created = False
+
+    def _ensure_created(self):
+        from azure.core.exceptions import ResourceExistsError
+
+        if self._created:
+            return
+        for create in (self._container.create_container, self._queue.create_queue):
+            try:
+                create()
+            except ResourceExistsError:
+                pass
+        self._created = True
+
+    def save_files(self, job_id, contents):
+        self._ensure_created()
+        for index, content in enumerate(contents):
+            with open_source(content) as fp:
+                self._container.upload_blob(f"{job_id}/{index}.pdf", fp, overwrite=True)
+
+    def load_files(self, job_id):
+        job = self.get(job_id)
+        return [self._container.download_blob(f"{job_id}/{index}.pdf").readall() for index in range(len(job["files"]))]
+
+    def delete_files(self, job_id):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        for blob in self._container.list_blobs(name_starts_with=f"{job_id}/"):
+            if blob.name.endswith(".pdf"):
+                try:
+                    self._container.delete_blob(blob.name)
+                except ResourceNotFoundError:
+                    pass
+
+    def purge(self, cutoff):
+        """Delete every blob of jobs whose record was last written before
+        ``cutoff``."""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        self._ensure_created()
+        expired = {
+            blob.name.split("/")[0]
+            for blob in self._container.list_blobs()
+            if blob.name.endswith("/job.json") and blob.last_modified < cutoff
+        }
+        for job_id in expired:
+            for blob in self._container.list_blobs(name_starts_with=f"{job_id}/"):
+                try:
+                    self._container.delete_blob(blob.name)
+                except ResourceNotFoundError:
+                    pass
+
+    def put(self, job):
+        self._ensure_created()
+        self._container.upload_blob(f"{job['job_id']}/job.json", json.dumps(job), overwrite=True)
+
+    def get(self, job_id):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return json.loads(self._container.download_blob(f"{job_id}/job.json").readall())
+        except ResourceNotFoundError:
+            return None
+
+    def enqueue(self, job_id):
+        self._ensure_created()
+        self._queue.send_message(job_id)
+
+
+def get_store():
+    global _store
+    if _store is None:
+        connection_string = os.environ.get(STORAGE_CONNECTION_SETTING)
+        kind = os.environ.get(JOB_STORE_SETTING, "storage" if connection_string else "local").lower()
+        _store = StorageJobStore(connection_string) if kind == "storage" else LocalJobStore()
+    return _store
+
+
+def valid_job_id(job_id):
+    return bool(JOB_ID_PATTERN.match(job_id or ""))
+
+
+def _retention_hours():
+    try:
+        return float(os.environ.get(RETENTION_SETTING, DEFAULT_RETENTION_HOURS))
+    except ValueError:
+        logging.warning(f"Ignoring non-numeric app setting {RETENTION_SETTING}")
+        return DEFAULT_RETENTION_HOURS
+
+
+def purge_expired(store):
+    """Delete jobs not written to for JOB_RETENTION_HOURS, at most once
+    per PURGE_INTERVAL per worker."""
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    try:
+        store.purge(datetime.now(timezone.utc) - timedelta(hours=_retention_hours()))
+    except Exception:
+        logging.warning("Could not purge expired lab-data jobs", exc_info=True)
+
+
+def create_job(uploads, load_mode):
+    """Store the uploads, queue them for processing and return the job record."""
+    store = get_store()
+    purge_expired(store)
+    job_id = uuid.uuid4().hex
+    store.save_files(job_id, [upload.content for upload in uploads])
+    job = {
+        "job_id": job_id,
+        "status": "queued",
+        "load_mode": load_mode,
+        "created": _now(),
+        "updated": _now(),
+        "files": [
+            {"file_name": upload.file_name, "query_type": upload.query_type, "pages_done": 0, "page_count": None}
+            for upload in uploads
+        ],
+    }
+    store.put(job)
+    store.enqueue(job_id)
+    logging.info(f"Queued lab-data job {job_id} with {len(uploads)} file(s)")
+    return job
+
+
+def get_job(job_id):
+    return get_store().get(job_id) if valid_job_id(job_id) else None
+
+
+def run_job(job_id, store=None, dequeue_count=MAX_DEQUEUE_COUNT):
+    """Run the parse and load pipeline for a queued job, recording page
+    progress as it goes and the final per-file and per-table counts. Stage
+    timings are logged and exported the same way as for upload requests.
+
+    A database or storage failure is raised so the queue trigger can
+    redeliver the message. Until its last delivery (``dequeue_count`` of
+    MAX_DEQUEUE_COUNT) the job goes back to queued and keeps its PDFs; they
+    are deleted once it finishes."""
+    from shared_code.pipeline import Upload, load_batch, parse_uploads
+
+    if not valid_job_id(job_id):
+        logging.warning(f"Ignoring malformed lab-data job id {job_id!r}")
+        return
+    store = store or get_store()
+    job = store.get(job_id)
+    if job is None:
+        logging.warning(f"Unknown lab-data job {job_id}")
+        return
+    if job["status"] in TERMINAL_STATUSES:
+        logging.info(f"Lab-data job {job_id} already finished")
+        return
+
+    job["status"] = "running"
+    job["updated"] = _now()
+    store.put(job)
+
+    lock = threading.Lock()
+    last_write = [time.monotonic()]
+    timer = timing.RequestTimer("lab-data-worker")
+
+    result, failure = None, None
+    try:
+        contents = store.load_files(job_id)
+        uploads = [Upload(f["file_name"], content, f["query_type"]) for f, content in zip(job["files"], contents)]
+        file_index = {id(upload): index for index, upload in enumerate(uploads)}
+
+        def progress(upload, pages_done, page_count):
+            with lock:
+                entry = job["files"][file_index[id(upload)]]
+                entry["pages_done"], entry["page_count"] = pages_done, page_count
+                if pages_done == page_count or time.monotonic() - last_write[0] >= PROGRESS_INTERVAL:
+                    job["updated"] = _now()
+                    store.put(job)
+                    last_write[0] = time.monotonic()
+
+        with timing.activate(timer):
+            timing.count("files", len(uploads))
+            parsed_uploads = parse_uploads(uploads, job["load_mode"], progress)
+            result = load_batch(parsed_uploads, job["load_mode"])
+        if result.get("error"):
+            failure = RuntimeError(f"Database insert failed: {result['error']}")
+    except Exception as e:
+        failure = e
+
+    timing.emit(timer)
+    if failure is not None and dequeue_count < MAX_DEQUEUE_COUNT:
+        logging.warning(f"Lab-data job {job_id} failed on delivery {dequeue_count}, leaving it queued for a retry: {failure}")
+        job["status"] = "queued"
+        job["error"] = str(failure)
+        job["updated"] = _now()
+        store.put(job)
+        raise failure
+
+    job.pop("error", None)
+    if result is not None:
+        for entry, file_result in zip(job["files"], result["files"]):
+            entry.update(file_result)
+        job["status"] = result["status"]
+        job["tables"] = result["tables"]
+    else:
+        job["status"] = "failed"
+    if failure is not None:
+        logging.error(f"Lab-data job {job_id} failed: {failure}", exc_info=failure)
+        job["error"] = str(failure)
+
+    job["updated"] = _now()
+    store.put(job)
+    try:
+        store.delete_files(job_id)
+    except Exception:
+        logging.warning(f"Could not delete the PDFs of lab-data job {job_id}", exc_info=True)
+    logging.info(f"Lab-data job {job_id} finished with status {job['status']}")
+    if failure is not None:
+        raise failure
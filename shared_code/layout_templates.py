@@ -0,0 +1,110 @@
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import NamedTuple
+
+from pdfplumber import utils
+from pdfplumber.table import DEFAULT_JOIN_TOLERANCE, DEFAULT_SNAP_TOLERANCE, merge_edges
+
+# Same tolerances extract_tables() runs with under its default settings
+EDGE_MIN_LENGTH = 3
+INTERSECTION_TOLERANCE = 3
+HEADER_ROWS = 3  # sample location, sampling date and column heading rows
+
+_templates = OrderedDict()
+# Batch uploads match and learn templates from several parse threads
+_templates_lock = threading.Lock()
+
+
+class LayoutTemplate(NamedTuple):
+    columns: tuple
+    header_rows: tuple
+
+
+def _key(value):
+    return round(float(value), 1)
+
+
+def page_grid(page):
+    """Return the (column, row) boundaries of the page's ruled table.
+
+    Only pages whose ruling lines form one complete grid qualify: a single
+    edge per boundary, each spanning the whole table. For those pages the
+    table finder is guaranteed to produce exactly that grid, so cells can
+    be cut straight from the boundaries. Anything else returns None.
+    """
+    edges = utils.filter_edges(page.edges, "v") + utils.filter_edges(page.edges, "h")
+    edges = merge_edges(edges, snap_tolerance=DEFAULT_SNAP_TOLERANCE, join_tolerance=DEFAULT_JOIN_TOLERANCE)
+    edges = utils.filter_edges(edges, min_length=EDGE_MIN_LENGTH)
+
+    v_edges = sorted((e for e in edges if e["orientation"] == "v"), key=lambda e: e["x0"])
+    h_edges = sorted((e for e in edges if e["orientation"] == "h"), key=lambda e: e["top"])
+    if len(v_edges) < 2 or len(h_edges) < HEADER_ROWS + 1:
+        return None
+
+    columns = tuple(e["x0"] for e in v_edges)
+    rows = tuple(e["top"] for e in h_edges)
+    if len(set(columns)) != len(columns) or len(set(rows)) != len(rows):
+        return None
+
+    tolerance = INTERSECTION_TOLERANCE
+    for e in v_edges:
+        if e["top"] > rows[0] + tolerance or e["bottom"] < rows[-1] - tolerance:
+            return None
+    for e in h_edges:
+        if e["x0"] > columns[0] + tolerance or e["x1"] < columns[-1] - tolerance:
+            return None
+
+    return columns, rows
+
+
+def extract_grid(page, columns, rows):
+    """Cut the table text out of a grid, mirroring pdfplumber's Table.extract."""
+    cells = [[[] for _ in range(len(columns) - 1)] for _ in range(len(rows) - 1)]
+    for char in page.chars:
+        v_mid = (char["top"] + char["bottom"]) / 2
+        h_mid = (char["x0"] + char["x1"]) / 2
+        row = bisect_right(rows, v_mid) - 1
+        col = bisect_right(columns, h_mid) - 1
+        if 0 <= row < len(rows) - 1 and 0 <= col < len(columns) - 1:
+            cells[row][col].append(char)
+
+    return [
+        [utils.extract_text(cell_chars).strip() if cell_chars else "" for cell_chars in row_chars]
+        for row_chars in cells
+    ]
+
+
+def _fingerprint(page, columns):
+    return (_key(page.width), _key(page.height), tuple(_key(x) for x in columns))
+
+
+def match_template(page, grid):
+    """True when the page's grid matches a learned layout template."""
+    columns, rows = grid
+    fingerprint = _fingerprint(page, columns)
+    with _templates_lock:
+        template = _templates.get(fingerprint)
+        if template is None:
+            return False
+        if template.header_rows != tuple(_key(y) for y in rows[:HEADER_ROWS + 1]):
+            return False
+        _templates.move_to_end(fingerprint)
+        return True
+
+
+def learn_template(page, grid, table, max_templates):
+    """Remember the page's layout once its grid is confirmed to reproduce ``table``."""
+    if max_templates <= 0:
+        return
+    columns, rows = grid
+    if extract_grid(page, columns, rows) != table:
+        return
+    fingerprint = _fingerprint(page, columns)
+    with _templates_lock:
+        _templates[fingerprint] = LayoutTemplate(fingerprint[2], tuple(_key(y) for y in rows[:HEADER_ROWS + 1]))
+        _templates.move_to_end(fingerprint)
+        while len(_templates) > max_templates:
+            _templates.popitem(last=False)
+    logging.info(f"Learned layout template with {len(columns) - 1} columns")
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from shared_code import int_setting
+from shared_code.intake import iter_source_chunks
+from shared_code.row_buffer import RowBuffer
+
+# App settings: entries kept in memory per worker, plus an optional
+# directory (e.g. a mounted file share) that survives worker recycling
+MEMORY_ENTRIES_SETTING = "PARSE_CACHE_SIZE"
+DISK_DIR_SETTING = "PARSE_CACHE_DIR"
+DISK_ENTRIES_SETTING = "PARSE_CACHE_DISK_ENTRIES"
+DEFAULT_MEMORY_ENTRIES = 32
+DEFAULT_DISK_ENTRIES = 256
+
+_memory = OrderedDict()
+# Batch uploads read and fill the cache from several parse threads
+_memory_lock = threading.Lock()
+
+
+def content_key(file_content, query_type):
+    """Hash of the uploaded PDF bytes plus the query_type they were parsed as."""
+    digest = hashlib.sha256(query_type.encode())
+    digest.update(b"\0")
+    for chunk in iter_source_chunks(file_content):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _disk_path(key):
+    directory = os.environ.get(DISK_DIR_SETTING)
+    return os.path.join(directory, f"{key}.json") if directory else None
+
+
+def _remember(key, entry):
+    with _memory_lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > int_setting(MEMORY_ENTRIES_SETTING, DEFAULT_MEMORY_ENTRIES):
+            _memory.popitem(last=False)
+
+
+def _write_disk(key, entry):
+    path = _disk_path(key)
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "rows": entry["rows"].to_json(),
+                "page_stats": entry["page_stats"],
+                "outcome": entry["outcome"],
+            }, f)
+        os.replace(tmp_path, path)
+
+        # Evict the least recently written entries past the limit
+        directory = os.path.dirname(path)
+        files = [os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".json")]
+        excess = len(files) - int_setting(DISK_ENTRIES_SETTING, DEFAULT_DISK_ENTRIES)
+        if excess > 0:
+            for old_path in sorted(files, key=os.path.getmtime)[:excess]:
+                os.remove(old_path)
+    except OSError:
+        logging.warning("Could not write parse cache entry to disk", exc_info=True)
+
+
+def _read_disk(key):
+    path = _disk_path(key)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        rows = RowBuffer.from_json(data["rows"])
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        # Includes entries written in an older format
+        logging.warning("Ignoring unreadable parse cache entry", exc_info=True)
+        return None
+    return {
+        "rows": rows,
+        "page_stats": data["page_stats"],
+        "outcome": data["outcome"],
+    }
+
+
+def get(key):
+    """Return the cached entry for ``key`` or None.
+
+    An entry holds the parsed ``rows`` (a RowBuffer), the ``page_stats``
+    of that parse and the ``outcome`` of the last database load, if any.
+    """
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+            return entry
+    entry = _read_disk(key)
+    if entry is not None:
+        _remember(key, entry)
+    return entry
+
+
+def put(key, rows, page_stats):
+    entry = {"rows": rows, "page_stats": dict(page_stats), "outcome": None}
+    _remember(key, entry)
+    _write_disk(key, entry)
+    return entry
+
+
+def record_outcome(key, load_mode, counts):
+    """Store the database outcome for a parse: the upload's row counts (see
+    pipeline.upload_counts), or None when the load failed."""
+    entry = get(key)
+    if entry is None:
+        return
+    entry["outcome"] = {"load_mode": load_mode, "counts": counts}
+    _write_disk(key, entry)
+
+
+def previous_counts(entry, load_mode):
+    """Row counts of the earlier successful load in the same mode, if any.
+    Outcomes written in an older format hold no counts."""
+    outcome = entry["outcome"]
+    if outcome and outcome["load_mode"] == load_mode:
+        return outcome.get("counts")
+    return None
@@ -0,0 +1,207 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from shared_code import export, parse_cache, timing
+from shared_code.analytes import FIELD_MAP, QUERY_TYPE_TO_TABLE, RESOLVERS
+from shared_code.db import load_tables
+from shared_code.extraction import extract_table_rows, iter_page_tables
+from shared_code.row_buffer import RowBuffer
+
+# Files in a batch are parsed on threads, which hand their pages to the
+# extraction process pool
+MAX_PARSE_THREADS = 4
+
+
+class Upload(NamedTuple):
+    file_name: Optional[str]
+    content: object  # PDF bytes, a memoryview of them, or an intake.SpilledFile
+    query_type: Optional[str]
+
+
+class ParsedUpload(NamedTuple):
+    upload: Upload
+    cache_key: Optional[str]
+    combined_rows: Optional[RowBuffer]
+    page_stats: dict
+    previous_counts: Optional[dict] = None
+    error: Optional[str] = None
+
+
+def parse_pdf(file_content, query_type, file_name, page_stats, progress=None, concurrent=False):
+    """Extract combined rows keyed on (sample location, sampling date/time).
+    ``concurrent`` is passed on to iter_page_tables."""
+    resolver = RESOLVERS[query_type]
+    combined_rows = RowBuffer(query_type, file_name)
+
+    logging.info("Opening PDF...")
+    for page_number, tables in iter_page_tables(file_content, query_type, page_stats, progress, concurrent):
+        for t_idx, table in enumerate(tables):
+            with timing.stage("match"):
+                kept = extract_table_rows(table, resolver, combined_rows, t_idx)
+            timing.count("tables_kept" if kept else "tables_skipped")
+    logging.info(f"Page summary: {dict(page_stats)}")
+    return combined_rows
+
+
+def parse_upload(upload, load_mode, progress=None, concurrent=False):
+    """Parse one upload, reusing the parse cache for repeat uploads.
+
+    Repeat uploads skip extraction, and carry the earlier load's row counts
+    in ``previous_counts`` when that load in this mode succeeded.
+    ``progress(upload, pages_done, page_count)`` reports extraction progress.
+    ``concurrent`` marks uploads parsed alongside others in a batch.
+    """
+    if upload.query_type not in FIELD_MAP:
+        return ParsedUpload(upload, None, None, {}, error="Invalid or missing query_type")
+
+    with timing.stage("hash"):
+        cache_key = parse_cache.content_key(upload.content, upload.query_type)
+    cached = parse_cache.get(cache_key)
+    if cached:
+        timing.count("parse_cache_hits")
+        previous = parse_cache.previous_counts(cached, load_mode)
+        if previous:
+            logging.info(f"Duplicate upload of {upload.file_name}, returning the previous outcome")
+            return ParsedUpload(upload, cache_key, None, cached["page_stats"], previous)
+        logging.info(f"Parse cache hit for {upload.file_name}, skipping PDF extraction")
+        rows = cached["rows"].with_file_name(upload.file_name)
+        return ParsedUpload(upload, cache_key, rows, cached["page_stats"])
+
+    page_stats = Counter()
+    page_progress = (lambda done, total: progress(upload, done, total)) if progress else None
+    rows = parse_pdf(upload.content, upload.query_type, upload.file_name, page_stats, page_progress, concurrent)
+    parse_cache.put(cache_key, rows, page_stats)
+    timing.merge_counts(page_stats)
+    return ParsedUpload(upload, cache_key, rows, dict(page_stats))
+
+
+def parse_uploads(uploads, load_mode, progress=None):
+    """Parse uploads concurrently. A file that fails to parse is returned
+    with its error instead of failing the rest of the batch. Stage timings
+    and counters from every thread go to the caller's active timer.
+
+    The threads mostly wait on the extraction process pool: in a batch,
+    even PDFs too small to shard are extracted there as one shard.
+    """
+    timer = timing.current()
+    concurrent = len(uploads) > 1
+
+    def parse(upload):
+        with timing.activate(timer):
+            try:
+                return parse_upload(upload, load_mode, progress, concurrent)
+            except Exception as e:
+                logging.exception(f"Failed to parse {upload.file_name}")
+                return ParsedUpload(upload, None, None, {}, error=str(e))
+
+    if len(uploads) == 1:
+        return [parse(uploads[0])]
+    with ThreadPoolExecutor(max_workers=min(len(uploads), MAX_PARSE_THREADS)) as pool:
+        return list(pool.map(parse, uploads))
+
+
+def needs_load(parsed):
+    return not parsed.error and parsed.previous_counts is None and bool(parsed.combined_rows)
+
+
+def upload_counts(parsed, load_mode, table_counts=None):
+    """Row counts of a successful load of ``parsed``, independent of the
+    response they end up in, so a repeat upload gets the same response
+    shape whichever path loaded it first.
+
+    ``rows`` is always given. ``inserted``, ``updated`` and ``unchanged``
+    are None when a merge loaded other uploads into the same table, since
+    the table's ``table_counts`` can't be split between them.
+    """
+    rows = len(parsed.combined_rows)
+    if load_mode != "merge":
+        return {"rows": rows, "inserted": rows, "updated": 0, "unchanged": 0}
+    if table_counts is None:
+        return {"rows": rows, "inserted": None, "updated": None, "unchanged": None}
+    return {"rows": rows, **{k: table_counts.get(k, 0) for k in ("inserted", "updated", "unchanged")}}
+
+
+def load_parsed(parsed_uploads, load_mode):
+    """Write the rows of every upload that needs loading, grouped per
+    target table, in one transaction. Returns the counts per table; the
+    outcome is recorded in the parse cache either way."""
+    pending = [p for p in parsed_uploads if needs_load(p)]
+    groups = {}
+    for parsed in pending:
+        groups.setdefault(QUERY_TYPE_TO_TABLE[parsed.upload.query_type], []).append(parsed.combined_rows)
+
+    if not groups:
+        return {}
+    timing.count("rows", sum(len(p.combined_rows) for p in pending))
+    try:
+        with timing.stage("db"):
+            counts = load_tables(groups, load_mode)
+    except Exception:
+        for parsed in pending:
+            parse_cache.record_outcome(parsed.cache_key, load_mode, None)
+        raise
+    export.invalidate(groups)
+    return counts
+
+
+def load_batch(parsed_uploads, load_mode):
+    """Load parsed uploads in one transaction and summarise each file.
+
+    Returns a dict with the overall ``status`` (success, partial or
+    failed), per-file entries and the per-table counts. A database failure
+    fails every file that needed loading and is reported as ``error``.
+    """
+    files = []
+    for parsed in parsed_uploads:
+        entry = {"file_name": parsed.upload.file_name, "query_type": parsed.upload.query_type, "page_stats": parsed.page_stats}
+        if parsed.error:
+            entry.update(status="failed", error=parsed.error)
+        elif parsed.previous_counts is None and not parsed.combined_rows:
+            entry.update(status="failed", error="No valid data found in PDF")
+        files.append(entry)
+
+    try:
+        counts = load_parsed(parsed_uploads, load_mode)
+        db_error = None
+    except Exception as e:
+        logging.exception("❌ Database insert failed.")
+        counts, db_error = {}, str(e)
+
+    # Merge counts are per table, so they only belong to a file that had
+    # its table to itself
+    sharing = Counter(QUERY_TYPE_TO_TABLE[p.upload.query_type] for p in parsed_uploads if needs_load(p))
+    for parsed, entry in zip(parsed_uploads, files):
+        if "status" in entry:
+            continue
+        if db_error and needs_load(parsed):
+            entry.update(status="failed", error=f"Database insert failed: {db_error}")
+            continue
+        if parsed.previous_counts:
+            upload = parsed.previous_counts
+        else:
+            table = QUERY_TYPE_TO_TABLE[parsed.upload.query_type]
+            upload = upload_counts(parsed, load_mode, counts.get(table) if sharing[table] == 1 else None)
+            parse_cache.record_outcome(parsed.cache_key, load_mode, upload)
+        entry["status"] = "success"
+        if load_mode == "merge":
+            entry["merged_rows"] = upload["rows"]
+        else:
+            entry["inserted_rows"] = upload["inserted"]
+        if parsed.previous_counts:
+            entry["duplicate_upload"] = True
+
+    succeeded = sum(1 for entry in files if entry["status"] == "success")
+    if succeeded == len(files):
+        status = "success"
+    elif succeeded:
+        status = "partial"
+    else:
+        status = "failed"
+    logging.info(f"Batch upload: {succeeded} of {len(files)} files loaded")
+
+    result = {"status": status, "files": files, "tables": counts}
+    if db_error:
+        result["error"] = db_error
+    return result
@@ -0,0 +1,94 @@
+import sys
+from array import array
+
+from shared_code.analytes import FIELD_MAP
+
+# FIELD_MAP columns ahead of the analyte results
+KEY_FIELD_COUNT = 3
+
+COLUMN_INDEX = {
+    query_type: {field: i for i, field in enumerate(fields[KEY_FIELD_COUNT:])}
+    for query_type, fields in FIELD_MAP.items()
+}
+
+
+class RowBuffer:
+    """Sample results of one upload, held column by column.
+
+    Rows are keyed on (sample location, sampling date/time), in the order
+    the samples were first seen. Each analyte column of the query_type's
+    FIELD_MAP is a float array plus a presence mask. A missing or
+    non-numeric result is a cleared mask bit, so it reaches the database
+    as NULL. Buffers are not changed once parsing finishes, so cached
+    copies can share their columns.
+    """
+
+    def __init__(self, query_type, file_name=None):
+        self.query_type = query_type
+        self.fields = FIELD_MAP[query_type]
+        self.file_name = file_name
+        self.keys = []
+        self._rows = {}
+        self.values = [array("d") for _ in COLUMN_INDEX[query_type]]
+        self.present = [bytearray() for _ in COLUMN_INDEX[query_type]]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, field):
+        return COLUMN_INDEX[self.query_type][field]
+
+    def row(self, sample_location, sample_datetime):
+        """Row index for a sample, adding an empty row the first time."""
+        key = (sample_location, sample_datetime)
+        index = self._rows.get(key)
+        if index is None:
+            index = self._rows[key] = len(self.keys)
+            self.keys.append((sys.intern(sample_location), None if sample_datetime is None else sys.intern(sample_datetime)))
+            for values, present in zip(self.values, self.present):
+                values.append(0.0)
+                present.append(0)
+        return index
+
+    def set(self, row, column, value):
+        """Store a parsed result; None clears any earlier value."""
+        if value is None:
+            self.present[column][row] = 0
+        else:
+            self.values[column][row] = value
+            self.present[column][row] = 1
+
+    def param_rows(self):
+        """Yield database parameters per row, in FIELD_MAP column order."""
+        columns = list(zip(self.values, self.present))
+        for row, (sample_location, sample_datetime) in enumerate(self.keys):
+            yield [self.file_name, sample_location, sample_datetime] + [
+                values[row] if present[row] else None for values, present in columns
+            ]
+
+    def with_file_name(self, file_name):
+        """A copy labelled with another upload's file name, sharing columns."""
+        copy = RowBuffer.__new__(RowBuffer)
+        copy.__dict__.update(self.__dict__, file_name=file_name)
+        return copy
+
+    def to_json(self):
+        return {
+            "query_type": self.query_type,
+            "file_name": self.file_name,
+            "keys": [list(key) for key in self.keys],
+            "values": [
+                [value if flag else None for value, flag in zip(values, present)]
+                for values, present in zip(self.values, self.present)
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        buffer = cls(data["query_type"], data["file_name"])
+        for sample_location, sample_datetime in data["keys"]:
+            buffer.row(sample_location, sample_datetime)
+        for column, values in enumerate(data["values"]):
+            for row, value in enumerate(values):
+                buffer.set(row, column, value)
+        return buffer
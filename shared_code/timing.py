@@ -0,0 +1,187 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Custom metrics go to the Application Insights resource the function app
+# already logs to; without a connection string only the log record is written
+APPINSIGHTS_CONNECTION_SETTING = "APPLICATIONINSIGHTS_CONNECTION_STRING"
+METRIC_PREFIX = "lab_data"
+METRIC_EXPORT_INTERVAL_MS = 60000
+
+_local = threading.local()
+_meter = None
+_instruments = {}
+_meter_lock = threading.Lock()
+
+
+class RequestTimer:
+    """Stage durations and counters for one upload request or job.
+
+    Stage times are summed over every call, so stages that run on several
+    threads or pool workers add up to more than the wall-clock total.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.durations = Counter()  # seconds per stage
+        self.counters = Counter()
+        self.values = {}  # point-in-time readings, e.g. memory
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            self.durations[stage_name] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def merge(self, durations=None, counters=None):
+        with self._lock:
+            self.durations.update(durations or {})
+            self.counters.update(counters or {})
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Value for the Server-Timing response header, in milliseconds."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def record(self):
+        return {
+            "name": self.name,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()},
+            "counters": dict(self.counters),
+            **{name: round(value, 1) for name, value in self.values.items()},
+        }
+
+
+def current():
+    return getattr(_local, "timer", None)
+
+
+@contextmanager
+def activate(timer):
+    """Make ``timer`` the one stage() and count() report to on this thread."""
+    previous = current()
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+@contextmanager
+def stage(name):
+    """Time a block against the active timer; a no-op without one."""
+    timer = current()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    timer = current()
+    if timer is not None and n:
+        timer.count(name, n)
+
+
+def merge_counts(counts):
+    timer = current()
+    if timer is not None:
+        timer.merge(counters=counts)
+
+
+def rss_bytes():
+    """Current resident set size of this worker, or 0 where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_bytes():
+    """High-water resident set size of this worker process."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def sample_memory():
+    """Record the current RSS, keeping the first and highest readings.
+
+    Only the points where this is called are seen, so the highest reading
+    is a lower bound on the request's true peak.
+    """
+    timer = current()
+    if timer is None:
+        return
+    rss_mb = rss_bytes() / 2**20
+    timer.values.setdefault("rss_start_mb", rss_mb)
+    timer.values["rss_max_sampled_mb"] = max(rss_mb, timer.values.get("rss_max_sampled_mb", 0))
+
+
+def _get_meter():
+    global _meter
+    with _meter_lock:
+        if _meter is None:
+            connection_string = os.environ.get(APPINSIGHTS_CONNECTION_SETTING)
+            _meter = False
+            if connection_string:
+                try:
+                    from azure.monitor.opentelemetry.exporter import AzureMonitorMetricExporter
+                    from opentelemetry.sdk.metrics import MeterProvider
+                    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+                except ImportError:
+                    logging.warning("azure-monitor-opentelemetry-exporter is not installed; request metrics are only logged")
+                else:
+                    reader = PeriodicExportingMetricReader(
+                        AzureMonitorMetricExporter(connection_string=connection_string),
+                        export_interval_millis=METRIC_EXPORT_INTERVAL_MS,
+                    )
+                    _meter = MeterProvider(metric_readers=[reader]).get_meter(METRIC_PREFIX)
+        return _meter
+
+
+def _instrument(kind, name, unit=""):
+    key = (kind, name)
+    if key not in _instruments:
+        create = _meter.create_counter if kind == "counter" else _meter.create_histogram
+        _instruments[key] = create(f"{METRIC_PREFIX}.{name}", unit=unit)
+    return _instruments[key]
+
+
+def emit(timer):
+    """Log the timer's record and export it as Application Insights custom
+    metrics. Metrics are aggregated in-process and sent once a minute."""
+    record = timer.record()
+    logging.info({"request_timing": record})
+    if not _get_meter():
+        return
+    try:
+        attributes = {"function": timer.name}
+        _instrument("histogram", "duration", "ms").record(record["total_ms"], attributes)
+        for name, ms in record["stages_ms"].items():
+            _instrument("histogram", "stage_duration", "ms").record(ms, {**attributes, "stage": name})
+        for name, value in timer.counters.items():
+            _instrument("counter", name).add(value, attributes)
+        for name, value in timer.values.items():
+            _instrument("histogram", name, "MB").record(value, attributes)
+    except Exception:
+        logging.exception("Failed to record request metrics")
@@ -0,0 +1,56 @@
+import pytest
+
+from shared_code.analytes import RESOLVERS, AnalyteResolver
+
+# (query_type, raw label, expected field); each step of the match chain,
+# in the order the original per-cell chain tried them
+MATCHES = [
+    # Strict name, after normalization
+    ("ds-int", "Total Nitrogen as N", "Total Nitrogen as N"),
+    ("ds-int", "Electrical Conductivity @ 25°C", "Electrical Conductivity @ 25°C"),
+    ("ds-ext", "  total   MERCURY ", "Total Mercury"),
+    # CAS number, only for fields of the query_type
+    ("ds-ext", "Arsenic 7440-38-2", "Total Arsenic"),
+    ("ds-pfas", "EtFOSAA 2991-50-6", "N-Ethyl perfluorooctane sulfonamidoacetic acid"),
+    ("ds-int", "Arsenic 7440-38-2", None),
+    # Partial match overrides, which aren't limited to the query_type
+    ("ds-ext", "C10 - C14 Fraction", "TPH Silica C10 - C14 Fraction"),
+    ("ds-ext", ">C10 - C16 Fraction", "TRH C10 - C16 Fraction"),
+    ("ds-ext", "^ C6 - C10 Fraction minus BTEX C6_C10-BTEX (F1)", "TRH NEPMC6 - C10 Fraction minus BTEX"),
+    ("ds-int", "C10 - C14 Fraction", "TPH Silica C10 - C14 Fraction"),
+    # Abbreviations
+    ("ds-pfas", "MeFOSA", "N-Methyl perfluorooctane sulfonamide"),
+    ("ds-pfas", "EtFOSE (surr.)", "N-Ethyl perfluorooctane sulfonamidoethanol"),
+    ("ds-int", "MeFOSA", None),
+    # Field name inside the label, earliest field first
+    ("ds-pfas", "Perfluorooctanoic acid (PFOA)", "Perfluorooctanoic acid"),
+    ("ds-pfas", "Perfluorooctane sulfonic acid (PFOS)", "Perfluorooctane sulfonic acid"),
+    ("ds-pfas", "N-Ethyl perfluorooctane sulfonamidoacetic acid (EtFOSAA)", "N-Ethyl perfluorooctane sulfonamidoacetic acid"),
+    ("ds-pfas", "Sum of PFAS (WA DER List)", "Sum of PFAS"),
+    # Label inside a field name, earliest field first
+    ("ds-ext", "Organic Carbon", "Total Organic Carbon"),
+    ("ds-ext", "Fraction minus Naphthalene", "TRH C10 - C16 Fraction minus Naphthalene"),
+    # Both ways round: "phenol" is inside the label and the label is inside
+    # "2-Methylphenol"; Phenol comes first in FIELD_MAP
+    ("ds-ext", "Methylphenol", "Phenol"),
+    # Too short for the substring fallback, or no field at all
+    ("ds-ext", "Carbon", None),
+    ("ds-ext", "Moisture Content", None),
+    ("ds-ext", "Chromium (hexavalent)", None),
+]
+
+SKIPPED = ["", "Results", "CAS", "Sample ID", "Sub-Matrix: WATER", "EP080: BTEXN", "Toluene-D8 Surrogate", "Page 2 of 5"]
+
+
+@pytest.mark.parametrize("query_type, label, field", MATCHES)
+def test_match_chain(query_type, label, field):
+    resolution = RESOLVERS[query_type].resolve(label)
+
+    assert (resolution.match, resolution.skipped) == (field, False)
+
+
+@pytest.mark.parametrize("label", SKIPPED)
+def test_non_analyte_labels_are_skipped(label):
+    for query_type in ("ds-pfas", "ds-int", "ds-ext"):
+        resolution = AnalyteResolver(query_type).resolve(label)
+        assert (resolution.match, resolution.skipped) == (None, True)
@@ -0,0 +1,59 @@
+import re
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from shared_code import db
+
+FIELDS = ["File Name", "Sample Location", "Sampling Date/Time", "A", "B"]
+
+
+def test_mssql_merge_counts_updates_per_staged_row():
+    sql = db._merge_mssql_sql("[Jackson].[DSInt]", FIELDS, "#lab_staging")
+
+    assert f"DECLARE @actions TABLE ([action] nvarchar(10), [{db.ORDER_COLUMN}] int);" in sql
+    assert f"OUTPUT $action, s.[{db.ORDER_COLUMN}] INTO @actions;" in sql
+    assert f"(SELECT COUNT(DISTINCT [{db.ORDER_COLUMN}]) FROM @actions WHERE [action] = 'UPDATE')" in sql
+    assert "(SELECT COUNT(*) FROM @actions WHERE [action] = 'INSERT')" in sql
+
+
+def test_mssql_merge_statement_shape():
+    sql = db._merge_mssql_sql("[Jackson].[DSInt]", FIELDS, "#lab_staging")
+
+    assert "MERGE [Jackson].[DSInt] WITH (HOLDLOCK) AS t" in sql
+    # Keys are matched NULL-safely and never updated
+    assert "(t.[Sampling Date/Time] = s.[Sampling Date/Time] OR (t.[Sampling Date/Time] IS NULL AND s.[Sampling Date/Time] IS NULL))" in sql
+    update_set = re.search(r"UPDATE SET (.*)", sql).group(1)
+    assert "[Sample Location]" not in update_set and "[Sampling Date/Time]" not in update_set
+    assert "t.[A] = COALESCE(s.[A], t.[A])" in update_set
+    assert "INSERT ([File Name], [Sample Location], [Sampling Date/Time], [A], [B])" in sql
+    # One source row per key, the last staged one
+    assert "PARTITION BY [Sample Location], [Sampling Date/Time]" in sql
+    assert f"ORDER BY [{db.ORDER_COLUMN}] DESC" in sql
+    assert sql.count("(") == sql.count(")")
+
+
+@pytest.fixture
+def conn():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        columns = ", ".join(f"[{f}] {'TEXT' if i < 3 else 'NUMERIC'}" for i, f in enumerate(FIELDS))
+        conn.execute(text(f"CREATE TABLE t ({columns})"))
+        yield conn
+
+
+def test_merge_counts_with_duplicate_target_rows(conn):
+    # An earlier insert-mode load left L1 twice
+    db._insert_rows(conn, "t", FIELDS, [["f.pdf", "L1", "d", 1.0, 2.0], ["f.pdf", "L1", "d", 1.0, 2.0], ["f.pdf", "L2", "d", 1.0, None]])
+
+    counts = db._merge_rows(conn, "t", FIELDS, [["f.pdf", "L1", "d", 5.0, None], ["f.pdf", "L2", "d", 1.0, None], ["f.pdf", "L3", "d", 1.0, None]])
+
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 1}
+    rows = conn.execute(text("SELECT [Sample Location], [A], [B] FROM t ORDER BY 1")).fetchall()
+    assert rows == [("L1", 5, 2), ("L1", 5, 2), ("L2", 1, None), ("L3", 1, None)]
+
+
+def test_merge_repeat_is_unchanged(conn):
+    rows = [["f.pdf", "L1", None, 1.0, 2.0], ["f.pdf", "L2", "d", 3.0, None]]
+    assert db._merge_rows(conn, "t", FIELDS, [list(r) for r in rows]) == {"inserted": 2, "updated": 0, "unchanged": 0}
+    assert db._merge_rows(conn, "t", FIELDS, [list(r) for r in rows]) == {"inserted": 0, "updated": 0, "unchanged": 2}
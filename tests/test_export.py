@@ -0,0 +1,94 @@
+import json
+import random
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+
+from shared_code import db, export
+from shared_code.analytes import FIELD_MAP
+
+FIELDS = FIELD_MAP["ds-int"]
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    monkeypatch.setenv("EXPORT_CACHE_TTL", "0")
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    event.listen(engine, "connect", lambda con, _: con.execute("ATTACH DATABASE ':memory:' AS Jackson"))
+    monkeypatch.setattr(db, "_engine", engine)
+
+    # Few distinct keys, so most rows share theirs with rows of other values
+    rnd = random.Random(3)
+    rows = [
+        [rnd.choice(["a.pdf", "b.pdf", None]), rnd.choice(["MW1", "MW2", None]), rnd.choice(["01-Mar-2024 08:00", "02-Mar-2024 09:00", None])]
+        + [rnd.choice([None, 1.5, 2.5]) for _ in FIELDS[3:]]
+        for _ in range(120)
+    ]
+    with engine.begin() as conn:
+        columns = ", ".join(f"[{f}] {'TEXT' if i < 3 else 'REAL'}" for i, f in enumerate(FIELDS))
+        conn.execute(text(f"CREATE TABLE Jackson.DSInt ({columns})"))
+        db._insert_rows(conn, "[Jackson].[DSInt]", FIELDS, [list(r) for r in rows])
+    return rows
+
+
+def read_all(params, limit):
+    out, cursor = [], None
+    while True:
+        query = export.parse_query({**params, "limit": str(limit), **({"cursor": cursor} if cursor else {})})
+        body, cursor, count = export.read_page(query)
+        page = [[row[f] for f in FIELDS] for row in map(json.loads, body.decode().splitlines())]
+        assert len(page) == count <= limit
+        out += page
+        if not cursor:
+            return out
+
+
+@pytest.mark.parametrize("limit", [1, 2, 7, 119, 120, 1000])
+def test_pages_cover_every_row_once_in_a_stable_order(rows, limit):
+    first = read_all({"query_type": "ds-int"}, limit)
+
+    assert sorted(map(json.dumps, first)) == sorted(map(json.dumps, rows))
+    assert read_all({"query_type": "ds-int"}, limit) == first
+    assert first == read_all({"query_type": "ds-int"}, 1000)
+
+
+def test_filters(rows):
+    got = read_all({"query_type": "ds-int", "location": "MW2", "file_name": "a.pdf", "date_from": "2024-03-02"}, 3)
+
+    expected = [r for r in rows if r[:3] == ["a.pdf", "MW2", "02-Mar-2024 09:00"]]
+    assert sorted(map(json.dumps, got)) == sorted(map(json.dumps, expected))
+
+
+def test_csv_header(rows):
+    body, _, count = export.read_page(export.parse_query({"query_type": "ds-int", "format": "csv", "limit": "5"}))
+
+    lines = body.decode().splitlines()
+    assert lines[0].split(",")[:3] == ["File Name", "Sample Location", "Sampling Date/Time"]
+    assert len(lines) == count + 1 == 6
+
+
+def test_mssql_page_seeks_on_raw_key_columns():
+    query = export.parse_query({
+        "query_type": "ds-int",
+        "date_from": "2024-03-01",
+        "cursor": export.encode_cursor(("MW1", None, "a.pdf"), 0),
+    })
+    sql, params, filter_dates = export._select(query, "mssql", row_limit=11)
+
+    assert sql.startswith("SELECT TOP (:row_limit) ")
+    assert sql.endswith(" ORDER BY [Sample Location], [Sampling Date/Time], [File Name]")
+    assert "COALESCE" not in sql
+    assert (
+        "([Sample Location] > :key0 OR ([Sample Location] = :key0 AND "
+        "([Sampling Date/Time] IS NOT NULL OR ([Sampling Date/Time] IS NULL AND ([File Name] > :key2)))))"
+    ) in sql
+    assert "TRY_CONVERT(datetime2, [Sampling Date/Time]) >= :date_from" in sql
+    assert params == {"key0": "MW1", "key2": "a.pdf", "date_from": query.date_from, "row_limit": 11}
+    assert not filter_dates
+
+
+def test_invalid_parameters():
+    for params in ({}, {"query_type": "ds-int", "limit": "0"}, {"query_type": "ds-int", "cursor": "zz"}, {"query_type": "ds-int", "format": "xml"}):
+        with pytest.raises(export.QueryError):
+            export.parse_query(params)
@@ -0,0 +1,48 @@
+from shared_code.analytes import RESOLVERS
+from shared_code.extraction import extract_table_rows, plan_table_rows
+from shared_code.row_buffer import RowBuffer
+
+
+def header(*locations):
+    return [
+        ["Sample Location", "", ""] + list(locations),
+        ["Sampling Date/Time", "", ""] + ["01-Mar-2024 08:00"] * len(locations),
+        ["Compound", "CAS Number", "Unit"] + [""] * len(locations),
+    ]
+
+
+def results(rows):
+    return {
+        key: {field: value for field, value in zip(rows.fields[3:], params[3:]) if value is not None}
+        for key, params in zip(rows.keys, rows.param_rows())
+    }
+
+
+def test_wrapped_label_on_the_last_row():
+    # "(filtered)" continues the label above it and ends the table, so the
+    # stitching loop has no further row to read
+    table = header("MW1") + [
+        ["Total Arsenic", "7440-38-2", "mg/L", "0.1"],
+        ["Total Mercury", "7439-97-6", "mg/L", "0.2"],
+        ["(filtered)", "", "", ""],
+    ]
+
+    plan = plan_table_rows(table, RESOLVERS["ds-ext"])
+    assert [(i, match, row[3]) for i, match, row in plan] == [(3, "Total Arsenic", "0.1"), (4, "Total Mercury", "0.2")]
+
+
+def test_fields_of_other_query_types_are_dropped():
+    # "C10 - C14 Fraction" resolves to a ds-ext field through the partial
+    # match overrides, which ds-int has no column for
+    table = header("MW1", "MW2") + [
+        ["Total Nitrogen as N", "----", "mg/L", "1.2", "<0.1"],
+        ["C10 - C14 Fraction", "----", "µg/L", "50", "60"],
+        ["Total Phosphorus as P", "----", "mg/L", "0.4", "0.5"],
+    ]
+    rows = RowBuffer("ds-int", "a.pdf")
+
+    assert extract_table_rows(table, RESOLVERS["ds-int"], rows)
+    assert results(rows) == {
+        ("MW1", "01-Mar-2024 08:00"): {"Total Nitrogen as N": 1.2, "Total Phosphorus as P": 0.4},
+        ("MW2", "01-Mar-2024 08:00"): {"Total Nitrogen as N": 0.1, "Total Phosphorus as P": 0.5},
+    }
@@ -0,0 +1,84 @@
+import pytest
+
+from shared_code import intake
+from shared_code.intake import Intake, MultipartError, SpilledFile, iter_parts
+
+CONTENT_TYPE = "multipart/form-data; boundary=xyz"
+
+
+def form(*parts, boundary="xyz", preamble=b"", epilogue=b""):
+    body = preamble
+    for headers, content in parts:
+        header_lines = headers + b"\r\n" if headers else b""
+        body += b"--" + boundary.encode() + b"\r\n" + header_lines + b"\r\n" + content + b"\r\n"
+    return body + b"--" + boundary.encode() + b"--\r\n" + epilogue
+
+
+def disposition(name, filename=None):
+    value = f'Content-Disposition: form-data; name="{name}"'
+    return (value + (f'; filename="{filename}"' if filename else "")).encode()
+
+
+def contents(body, content_type=CONTENT_TYPE):
+    return [(part.content_disposition, bytes(part.content)) for part in iter_parts(body, content_type)]
+
+
+def test_parts_are_views_of_the_body():
+    body = form((disposition("query_type"), b"ds-int"), (disposition("file", "a.pdf") + b"\r\nContent-Type: application/pdf", b"%PDF\r\n1"))
+
+    parts = list(iter_parts(body, CONTENT_TYPE))
+    assert [p.text if i == 0 else bytes(p.content) for i, p in enumerate(parts)] == ["ds-int", b"%PDF\r\n1"]
+    assert parts[1].content.obj is body
+    assert parts[1].headers["content-type"] == "application/pdf"
+
+
+def test_quoted_boundary():
+    body = form((disposition("a"), b"1"), boundary="b:c=d e")
+
+    assert contents(body, 'multipart/form-data; boundary="b:c=d e"; charset=utf-8') == [('form-data; name="a"', b"1")]
+
+
+def test_preamble_and_epilogue_are_ignored():
+    body = form((disposition("a"), b"1"), preamble=b"Preamble quoting --xyz--\r\n", epilogue=b"trailing --xyz\r\n")
+
+    assert contents(body) == [('form-data; name="a"', b"1")]
+
+
+def test_empty_part_and_part_without_headers():
+    body = form((disposition("a"), b""), (b"", b"bare"))
+
+    assert contents(body) == [('form-data; name="a"', b""), ("", b"bare")]
+
+
+def test_boundary_text_inside_content():
+    # Only a CRLF followed by the delimiter ends a part
+    body = form((disposition("file", "a.pdf"), b"--xyz--xyz\n--xyz\r--xyzz"))
+
+    assert contents(body) == [('form-data; name="file"; filename="a.pdf"', b"--xyz--xyz\n--xyz\r--xyzz")]
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"--xyz\r\n\r\n1\r\n--xyz--", "multipart/form-data"),
+    (b"no delimiter here", CONTENT_TYPE),
+    (b"--xyzjunk\r\n\r\n1\r\n--xyz--", CONTENT_TYPE),
+    (b"--xyz\r\n" + disposition("a"), CONTENT_TYPE),
+    (b"--xyz\r\n" + disposition("a") + b"\r\n\r\n1", CONTENT_TYPE),
+    (b"--xyz\r\n" + disposition("a") + b"\r\n\r\n1\r\n--xyz", CONTENT_TYPE),
+])
+def test_malformed_or_unterminated_bodies(body, content_type):
+    with pytest.raises(MultipartError):
+        list(iter_parts(body, content_type))
+
+
+def test_malformed_spill_setting_falls_back(monkeypatch):
+    monkeypatch.setenv(intake.SPILL_BYTES_SETTING, "10MB")
+    assert Intake().spill_bytes == intake.DEFAULT_SPILL_BYTES
+
+    monkeypatch.setenv(intake.SPILL_BYTES_SETTING, "3")
+    keep = Intake()
+    try:
+        assert keep.keep(memoryview(b"abc")) == b"abc"
+        spilled = keep.keep(memoryview(b"abcd"))
+        assert isinstance(spilled, SpilledFile) and open(spilled.path, "rb").read() == b"abcd"
+    finally:
+        keep.close()
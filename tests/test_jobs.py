@@ -0,0 +1,45 @@
+import pytest
+
+from shared_code import jobs, pipeline
+from shared_code.pipeline import Upload
+
+
+@pytest.fixture
+def job(monkeypatch):
+    store = jobs.LocalJobStore()
+    monkeypatch.setattr(store, "enqueue", lambda job_id: None)
+    monkeypatch.setattr(jobs, "_store", store)
+    monkeypatch.setattr(pipeline, "parse_uploads", lambda uploads, load_mode, progress=None: uploads)
+    return jobs.create_job([Upload("a.pdf", b"%PDF", "ds-int")], "insert"), store
+
+
+def fail_load(monkeypatch):
+    result = {"status": "failed", "files": [{"status": "failed", "error": "Database insert failed: timeout"}], "tables": {}, "error": "timeout"}
+    monkeypatch.setattr(pipeline, "load_batch", lambda parsed, load_mode: result)
+
+
+def test_database_failure_is_retried_with_the_pdfs_kept(job, monkeypatch):
+    job, store = job
+    fail_load(monkeypatch)
+
+    with pytest.raises(RuntimeError, match="timeout"):
+        jobs.run_job(job["job_id"], store, dequeue_count=1)
+    assert store.get(job["job_id"])["status"] == "queued"
+    assert store.load_files(job["job_id"]) == [b"%PDF"]
+
+    monkeypatch.setattr(pipeline, "load_batch", lambda parsed, load_mode: {"status": "success", "files": [{"status": "success", "inserted_rows": 3}], "tables": {}})
+    jobs.run_job(job["job_id"], store, dequeue_count=2)
+    finished = store.get(job["job_id"])
+    assert finished["status"] == "success" and "error" not in finished
+    assert finished["files"][0]["inserted_rows"] == 3
+    assert job["job_id"] not in store._files
+
+
+def test_last_delivery_marks_the_job_failed(job, monkeypatch):
+    job, store = job
+    fail_load(monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        jobs.run_job(job["job_id"], store, dequeue_count=jobs.MAX_DEQUEUE_COUNT)
+    assert store.get(job["job_id"])["status"] == "failed"
+    assert job["job_id"] not in store._files
@@ -0,0 +1,47 @@
+import os
+import importlib.util
+
+import pytest
+
+from shared_code import parse_cache, pipeline
+from shared_code.pipeline import Upload, load_batch, parse_upload
+from shared_code.row_buffer import RowBuffer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF = b"%PDF-1.4 repeat upload"
+
+
+def load_lab_data():
+    spec = importlib.util.spec_from_file_location("lab_data", os.path.join(ROOT, "lab-data", "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    monkeypatch.setattr(parse_cache, "_memory", type(parse_cache._memory)())
+    monkeypatch.delenv(parse_cache.DISK_DIR_SETTING, raising=False)
+    monkeypatch.setattr(pipeline, "load_tables", lambda groups, load_mode: {"[Jackson].[DSInt]": {"inserted": 1, "updated": 1, "unchanged": 0}})
+
+    rows = RowBuffer("ds-int")
+    rows.row("MW1", "01-Mar-2024 08:00")
+    rows.row("MW2", "01-Mar-2024 08:00")
+    parse_cache.put(parse_cache.content_key(PDF, "ds-int"), rows, {"pages": 1})
+    return lambda: parse_upload(Upload("a.pdf", PDF, "ds-int"), "merge")
+
+
+def test_repeat_single_upload_after_a_batch_load(parsed):
+    assert load_batch([parsed()], "merge")["files"][0]["merged_rows"] == 2
+
+    result, _ = load_lab_data().file_result(parsed(), "merge", {})
+    assert result == {"status": "success", "inserted_rows": 1, "updated_rows": 1, "unchanged_rows": 0, "duplicate_upload": True}
+
+
+def test_repeat_batch_upload_after_a_single_load(parsed):
+    lab_data = load_lab_data()
+    response = lab_data.single_response(parsed(), "merge")
+    assert response.status_code == 200
+
+    entry = load_batch([parsed()], "merge")["files"][0]
+    assert (entry["status"], entry["merged_rows"], entry["duplicate_upload"]) == ("success", 2, True)